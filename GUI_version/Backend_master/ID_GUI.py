@@ -2,7 +2,9 @@
 import pandas as pd
 import numpy as np
 import spectral_entropy    #https://github.com/FangLabNTU/SpectralEntropy
-import re
+from msms_parser import MSMSArrays, neutral_loss_spectra, parse_msms_spectra
+from id_network import iter_network_edges
+from pmd_index import PMDIndex
 
 ######################
 # Load the peak table from an Excel file
@@ -17,6 +19,17 @@ similarity_threshold = 0.5
 
 ms_threshold = 0.1  # m/z tolerance (Da).
 
+# Molecular network
+n_seeds = None  # Only compare the first n_seeds nodes with the others, None for all pairs.
+
+max_mass_difference = None  # Only compare pairs within this mass difference (Da), None for no limit.
+
+PMD_prefilter = 0  # 1: only compare pairs whose mass difference is in the PMD table.
+
+n_workers = 1  # Processes used for the similarity, None for ID_WORKERS (default the CPUs, at most 4). This script
+              # has no __main__ guard, so more than one process only works where processes are forked (Linux), not
+              # on Windows.
+
 ##########
 #Fen nodes check
 peak_table = pd.read_csv(file_path)
@@ -33,69 +46,35 @@ if Add_nodes == 1:
     
 PMD_table_path = "./ID/PMD.xlsx"
 PMD_table = pd.read_excel(PMD_table_path)
+PMD_index = PMDIndex(PMD_table['Mass Difference (Da)'], ms_threshold)
 ########
 
-# Remove trailing ':' from the 'MSMS spectrum' column
-peak_table['MSMS spectrum'] = peak_table['MSMS spectrum'].str.rstrip(':')
-
-# Function to process the MS/MS spectrum and return a dictionary
-def process_spectrum(spectrum):
-    if isinstance(spectrum, float):
-        return {}
-    return dict((float(mz.split(':')[0]), float(mz.split(':')[1])) for mz in spectrum.split(' '))
-
-# Apply the function to create 'MSMS_dict'
-peak_table['MSMS_dict'] = peak_table['MSMS spectrum'].apply(process_spectrum)
-
-# Calculate neutral loss and store in 'NL_spectrum'
-peak_table['NL_spectrum'] = peak_table.apply(lambda row: {round(row['Precursor m/z'] - mz, 5): intensity for mz, intensity in row['MSMS_dict'].items() if row['Precursor m/z'] - mz > 0}, axis=1)
-
-# Convert the 'NL_spectrum' into a string format
-peak_table['NL_spectrum_str'] = peak_table['NL_spectrum'].apply(lambda x: ' '.join([f'{mz}:{intensity}' for mz, intensity in x.items()]))
-
-# Create a new DataFrame to store processed data
-nodetable1 = pd.DataFrame(columns=["precursor", "RT", "PeakID", "ms2_data", "NL_data"])
-
-# Iterate over the rows in the peak table
-for index, row in peak_table.iterrows():
-    # If 'MSMS spectrum' is not empty
-    if not pd.isna(row["MSMS spectrum"]):
-        precursor = row["Precursor m/z"]
-        ms2_data = row["MSMS spectrum"]
-        PeakID = row["PeakID"]
-        
-        # Convert MS/MS spectrum data to DataFrame
-        ms2_df = pd.DataFrame([entry.split(':') for entry in ms2_data.split(" ")], columns=["mz", "intensity"])
-        ms2_df["mz"] = ms2_df["mz"].astype(float)
-        ms2_df["intensity"] = ms2_df["intensity"].astype(float)
-        
-        # Clean the spectrum using spectral_entropy library
-        clean_spectrum = spectral_entropy.clean_spectrum(ms2_df.to_numpy(), max_mz=800, noise_removal=0.01, ms2_da=0.01)
-        RT = row["RT (min)"]
-        
-        # Process neutral loss spectrum
-        NL_data = row["NL_spectrum_str"]
-        NL_df = pd.DataFrame([entry.split(':') for entry in NL_data.split()], columns=["mz", "intensity"])
-        NL_df["mz"] = NL_df["mz"].astype(float)
-        NL_df["intensity"] = NL_df["intensity"].astype(float)
-        
-        clean_NL_spectrum = spectral_entropy.clean_spectrum(NL_df.to_numpy(), max_mz=precursor, noise_removal=0.01, ms2_da=0.01)
-        
-        # Append to nodetable1 DataFrame
-        # Assuming clean_spectrum and clean_NL_spectrum are calculated before this step
-        new_row = pd.DataFrame([{"precursor": precursor, "RT": RT, "PeakID": PeakID, 
-                             "ms2_data": clean_spectrum, "NL_data": clean_NL_spectrum}])
-
-# Concatenate the new row to nodetable1
-        nodetable1 = pd.concat([nodetable1, new_row], ignore_index=True)
+# Parse all MS/MS spectra at once
+spectra = parse_msms_spectra(peak_table['MSMS spectrum'])
 
-    
-    # If 'MSMS spectrum' is empty
-    if pd.isna(row["MSMS spectrum"]):
-        precursor = row["Precursor m/z"]
-        RT = row["RT (min)"]
-        PeakID = row["PeakID"]
-        nodetable1 = nodetable1.append({"precursor": precursor, "RT": RT, "PeakID": PeakID}, ignore_index=True)
+# Collect the node table column by column, and create the DataFrame once at the end
+precursor_list = peak_table["Precursor m/z"].to_numpy(dtype=np.float64)
+has_spectrum = peak_table["MSMS spectrum"].notna().to_numpy()
+ms2_data_list = np.full(peak_table.shape[0], None, dtype=object)
+NL_data_list = np.full(peak_table.shape[0], None, dtype=object)
+
+# Calculate the neutral loss spectra of all rows
+NL_spectra = neutral_loss_spectra(spectra, precursor_list)
+
+# Clean all MS/MS and neutral loss spectra at once using spectral_entropy library
+clean_ms2 = MSMSArrays(*spectral_entropy.clean_spectra_batch(spectra.mz, spectra.intensity, spectra.offsets,
+                                                             max_mz=800, noise_removal=0.01, ms2_da=0.01))
+clean_NL = MSMSArrays(*spectral_entropy.clean_spectra_batch(NL_spectra.mz, NL_spectra.intensity, NL_spectra.offsets,
+                                                            max_mz=precursor_list, noise_removal=0.01, ms2_da=0.01))
+
+# Take the cleaned spectra of the rows with an MS/MS spectrum, the rows without one keep None as ms2_data
+for i in np.flatnonzero(has_spectrum):
+    ms2_data_list[i] = clean_ms2.spectrum(i)
+    NL_data_list[i] = clean_NL.spectrum(i)
+
+nodetable1 = pd.DataFrame({"precursor": precursor_list, "RT": peak_table["RT (min)"].to_numpy(),
+                           "PeakID": peak_table["PeakID"].to_numpy(),
+                           "ms2_data": ms2_data_list, "NL_data": NL_data_list})
 
 # Remove rows with missing 'ms2_data'
 nodetable1 = nodetable1.dropna(subset=['ms2_data'])
@@ -103,70 +82,26 @@ nodetable1 = nodetable1.dropna(subset=['ms2_data'])
 
 # %%
 
-# Create an empty DataFrame to store similarity scores
-similarity_df = pd.DataFrame(columns=["Precursor_a", "PeakID_a", "Precursor_b", "PeakID_b", "Mass_difference"])
-similarity_df1 = []
-similarity_df2 = []
-
-# Iterate through all possible combinations to calculate similarity
-max_index = max(nodetable1.index)
-
-# Only loop through the first two rows with other rows
-for index_a, row_a in nodetable1.iterrows():
-    if index_a >= 2:  # Only process the first two rows
-        break
-
-    for index_b in range(index_a + 1, max_index + 1):
-        if index_b in nodetable1.index:
-            row_b = nodetable1.loc[index_b]
-            Precursor_a = row_a["precursor"]
-            Precursor_b = row_b["precursor"]
-            Mass_difference = Precursor_b - Precursor_a
-            PeakID_a = row_a["PeakID"]
-            ms2_data_a = row_a["ms2_data"]
-            NL_data_a = row_a["NL_data"]
-            PeakID_b = row_b["PeakID"]
-            ms2_data_b = row_b["ms2_data"]
-            NL_data_b = row_b["NL_data"]
-
-            # Convert MS2 data to DataFrame
-            ms2_df_a = pd.DataFrame(ms2_data_a, columns=["mz", "intensity"])
-            NL_df_a = pd.DataFrame(NL_data_a, columns=["mz", "intensity"])
-            ms2_df_b = pd.DataFrame(ms2_data_b, columns=["mz", "intensity"])
-            NL_df_b = pd.DataFrame(NL_data_b, columns=["mz", "intensity"])
-
-            # Ensure data types are float
-            for df in [ms2_df_a, NL_df_a, ms2_df_b, NL_df_b]:
-                df["mz"] = df["mz"].astype(float)
-                df["intensity"] = df["intensity"].astype(float)
-
-            # Calculate similarity
-            all_dist = spectral_entropy.all_similarity(ms2_df_a.to_numpy(), ms2_df_b.to_numpy(), ms2_da=0.05)
-            similarity_values1 = {spectral_entropy.methods_name[dist_name]: value for dist_name, value in all_dist.items()}
-            similarity_df1.append(similarity_values1)
-
-            all_dist = spectral_entropy.all_similarity(NL_df_a.to_numpy(), NL_df_b.to_numpy(), ms2_da=0.005)
-            similarity_values2 = {spectral_entropy.methods_name[dist_name] + "_NL": value for dist_name, value in all_dist.items()}
-            similarity_df2.append(similarity_values2)
-
-            # Assuming similarity_df is a DataFrame and similarity_values contains the data
-            similarity_row = pd.DataFrame([{
-                "Precursor_a": Precursor_a,
-                "PeakID_a": PeakID_a,
-                "Precursor_b": Precursor_b,
-                "PeakID_b": PeakID_b,
-                "Mass_difference": Mass_difference
-            }])
-
-# Concatenate the new row to similarity_df
-            similarity_df = pd.concat([similarity_df, similarity_row], ignore_index=True)
-
-# Convert similarity score lists to DataFrames
-similarity_df1 = pd.DataFrame(similarity_df1)
-similarity_df2 = pd.DataFrame(similarity_df2)
-
-# Merge results
-result_df = pd.concat([similarity_df, similarity_df1, similarity_df2], axis=1)
+# Compare all pairs of nodes in blocks, in parallel; pairs failing the mass difference filters are skipped.
+# The edges come sorted by node pair.
+pair_filter = PMD_index if PMD_prefilter == 1 else None
+edges = list(iter_network_edges(nodetable1["precursor"].to_numpy(dtype=np.float64),
+                                nodetable1["ms2_data"], nodetable1["NL_data"], similarity_threshold,
+                                n_seeds=n_seeds, max_mass_difference=max_mass_difference,
+                                pair_filter=pair_filter, n_workers=n_workers))
+
+# Build the result table from the (index_a, index_b, mass difference, similarity, NL similarity) edges
+edges = np.array(edges, dtype=np.float64).reshape(-1, 5)
+index_a, index_b = edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64)
+result_df = pd.DataFrame({
+    "Precursor_a": nodetable1["precursor"].to_numpy()[index_a],
+    "PeakID_a": nodetable1["PeakID"].to_numpy()[index_a],
+    "Precursor_b": nodetable1["precursor"].to_numpy()[index_b],
+    "PeakID_b": nodetable1["PeakID"].to_numpy()[index_b],
+    "Mass_difference": edges[:, 2],
+    "MSforID distance version 1": edges[:, 3],
+    "MSforID distance version 1_NL": edges[:, 4]
+})
 
 # Remove rows where PeakID_a and PeakID_b are equal
 result_df = result_df[result_df['PeakID_a'] != result_df['PeakID_b']]
@@ -190,21 +125,10 @@ result_df = result_df[columns_to_keep]
 result_df = result_df[result_df['MSforID distance version 1'] > similarity_threshold]
 
 # Add 'Reaction' and 'Description' columns to result_df
-result_df['Reaction'] = None
-result_df['Description'] = None
-
-# Iterate through the 'Mass_difference' column in result_df
-# Iterate through each row of result_df
-for idx, row in result_df.iterrows():
-    mass_diff = row['Mass_difference']
-    
-    # Find matching rows in PMD_table
-    matches = PMD_table[abs(PMD_table['Mass Difference (Da)'] - abs(mass_diff)) <= ms_threshold]
-    
-    # If matching rows are found, assign 'Reaction' and 'Description' to result_df
-    if not matches.empty:
-        result_df.at[idx, 'Reaction'] = matches.iloc[0]['Reaction']
-        result_df.at[idx, 'Description'] = matches.iloc[0]['Description']
+# All mass differences are matched at once against the sorted PMD table, the first PMD row is used for several matches
+annotations = PMD_index.annotate(result_df['Mass_difference'], PMD_table)
+result_df['Reaction'] = annotations['Reaction']
+result_df['Description'] = annotations['Description']
 
 # Create a new column to ensure consistent order of inchikey1 and inchikey2
 def safe_sort(val):
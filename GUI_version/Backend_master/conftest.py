@@ -0,0 +1 @@
+# The backend modules (app, id_network, spectral_entropy, ...) are imported by the tests from this directory.
@@ -0,0 +1,112 @@
+import glob
+import os
+import time
+from concurrent.futures import as_completed
+
+import pandas as pd
+from spectral_entropy.parallel import state_pool, worker_state
+
+
+def expand_file_paths(file_paths) -> list:
+    """
+    The input files of a batch, in order and without duplicates.
+
+    :param file_paths: A path, a glob pattern (e.g. "D:/sequence/*.txt") or a list of them. The files matching a
+                       pattern are sorted by name.
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    expanded = []
+    for path in file_paths:
+        if glob.has_magic(path):
+            expanded.extend(sorted(glob.glob(path)))
+        else:
+            expanded.append(path)
+    return list(dict.fromkeys(expanded))
+
+
+def sample_name(file_path: str) -> str:
+    """The name of the sample of an MS-DIAL export: its file name without extension."""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def _screen_file(state, file_path, output_file):
+    """Run Finder on one MS-DIAL export and save its result, return the result and the time (s) of each step."""
+    start = time.perf_counter()
+    data = pd.read_csv(file_path, sep="\t")
+    read_done = time.perf_counter()
+    result = state["finder_logic"](data, *state["finder_args"])
+    finder_done = time.perf_counter()
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    result.to_csv(output_file, index=False)
+    write_done = time.perf_counter()
+    timings = {
+        "read_seconds": read_done - start,
+        "finder_seconds": finder_done - read_done,
+        "write_seconds": write_done - finder_done,
+        "seconds": write_done - start,
+    }
+    return result, timings
+
+
+def _screen_file_in_worker(file_path, output_file):
+    return _screen_file(worker_state, file_path, output_file)
+
+
+def _no_progress(stage, done=None, total=None):
+    pass
+
+
+def screen_files(files, finder_logic, finder_args: tuple, n_workers: int = None, progress=None) -> list:
+    """
+    Run Finder on each file, in parallel over n_workers processes, and save the result of each file.
+
+    The arguments, including the model, are sent once to each process and not loaded again for each file. A file
+    which cannot be processed does not stop the others, its error is returned instead of its result.
+
+    :param files: (input file, output file) of each sample.
+    :param finder_logic: The function called as finder_logic(peak table, *finder_args) for each file, returning the
+                         predicted peak table. Must be importable by the worker processes.
+    :param finder_args: The other arguments of finder_logic, e.g. the thresholds and the model.
+    :param n_workers: The number of processes, None to use all CPUs.
+    :param progress: A function called as progress("screen files", files done, total files) after each file.
+    :return: A list of (result, info) in the order of files, info has the timings of the file, or its error and a
+             None result.
+    """
+    if progress is None:
+        progress = _no_progress
+    results = [None] * len(files)
+    progress("screen files", 0, len(files))
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(files))
+
+    # The Finder function and its arguments shared by all files (thresholds and model), sent once to each process.
+    state = dict(finder_logic=finder_logic, finder_args=finder_args)
+    if n_workers <= 1:
+        for k, (file_path, output_file) in enumerate(files):
+            try:
+                results[k] = _screen_file(state, file_path, output_file)
+            except Exception as e:
+                results[k] = (None, {"error": str(e)})
+            progress("screen files", k + 1, len(files))
+        return results
+
+    with state_pool(n_workers, state) as executor:
+        futures = {executor.submit(_screen_file_in_worker, *file): k for k, file in enumerate(files)}
+        try:
+            for n_done, future in enumerate(as_completed(futures), 1):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = (None, {"error": str(e)})
+                progress("screen files", n_done, len(files))
+        except BaseException:
+            # Do not wait for the files not started yet, e.g. when progress() stops a cancelled job.
+            for future in futures:
+                future.cancel()
+            raise
+    return results
@@ -0,0 +1,287 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised in a running job at its next progress report, after cancel() was called."""
+
+
+class Job:
+    """
+    A request run in the background: its state, the stage it is at, and its result or error.
+
+    Every change of state and every progress report is also kept as an event, a dict with:
+        event: "state" or "progress".
+        state, stage, done, total: The state of the job, the stage it is at and the items done out of total (None when
+                                   not counted).
+        elapsed: Seconds since the job started.
+        stage_elapsed: Seconds since the stage started.
+        throughput: Items done per second in the stage, None when not counted.
+
+    With a state_dir, the job and its events are also saved in state_dir/<job id>.json at each change, for the other
+    processes of the server, which cancel it by creating state_dir/<job id>.json.cancel.
+    """
+
+    def __init__(self, kind: str, state_dir: str = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = QUEUED
+        self.stage = None
+        self.done = None
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self._stage_started_at = None
+        self._changed = threading.Condition()
+        self._cancel_requested = threading.Event()
+        self._future = None
+        self._state_file = None if state_dir is None else os.path.join(state_dir, self.id + ".json")
+        self._emit("state")
+
+    def progress(self, stage: str, done: int = None, total: int = None):
+        """
+        Report the stage the job is at, with the number of items done out of total when known.
+        This is also where a running job stops after cancel().
+        """
+        if self.cancel_requested():
+            raise JobCancelled()
+        with self._changed:
+            if stage != self.stage:
+                self._stage_started_at = time.time()
+            self.stage, self.done, self.total = stage, done, total
+            self._emit("progress")
+
+    def cancel_requested(self) -> bool:
+        if self._cancel_requested.is_set():
+            return True
+        if self._state_file is not None and os.path.exists(self._state_file + ".cancel"):
+            self._cancel_requested.set()
+            return True
+        return False
+
+    def set_state(self, state: str):
+        with self._changed:
+            self.state = state
+            if state == RUNNING:
+                self.started_at = time.time()
+            elif state in FINISHED_STATES:
+                self.finished_at = time.time()
+            self._emit("state")
+
+    def _emit(self, event):
+        """Keep the current state as an event and wake up the readers waiting for it."""
+        with self._changed:
+            now = time.time()
+            stage_elapsed = None if self._stage_started_at is None else now - self._stage_started_at
+            throughput = None
+            if self.done is not None and stage_elapsed:
+                throughput = self.done / stage_elapsed
+            self.events.append({
+                "event": event,
+                "job_id": self.id,
+                "state": self.state,
+                "stage": self.stage,
+                "done": self.done,
+                "total": self.total,
+                "elapsed": None if self.started_at is None else now - self.started_at,
+                "stage_elapsed": stage_elapsed,
+                "throughput": throughput,
+            })
+            self._changed.notify_all()
+            if self._state_file is not None:
+                _save_json(self._state_file, {"job": self.to_dict(), "events": self.events})
+
+    def wait_events(self, start: int, timeout: float = None) -> list:
+        """Return the events from index start, waiting up to timeout seconds for a new one if there is none yet."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > start, timeout)
+            return self.events[start:]
+
+    def to_dict(self, with_result: bool = True) -> dict:
+        info = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": self.events[-1]["elapsed"],
+            "throughput": self.events[-1]["throughput"],
+        }
+        if self.error is not None:
+            info["error"] = self.error
+        if with_result and self.result is not None:
+            info["result"] = self.result
+        return info
+
+
+class SharedJob:
+    """A job run by another process of the server, as last saved in its state file."""
+
+    def __init__(self, state_file: str):
+        self._state_file = state_file
+        self._load()
+
+    def _load(self):
+        with open(self._state_file) as f:
+            saved = json.load(f)
+        self._info = saved["job"]
+        self.events = saved["events"]
+        self.id = self._info["job_id"]
+        self.state = self._info["state"]
+        self.created_at = self._info["created_at"]
+        self.finished_at = self._info["finished_at"]
+
+    def wait_events(self, start: int, timeout: float = None, poll_interval: float = 0.5) -> list:
+        """Return the events from index start, reading the state file again until there is a new one or timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self.events) <= start and (deadline is None or time.time() < deadline):
+            time.sleep(poll_interval)
+            self._load()
+        return self.events[start:]
+
+    def to_dict(self, with_result: bool = True) -> dict:
+        info = dict(self._info)
+        if not with_result:
+            info.pop("result", None)
+        return info
+
+
+def _save_json(path, content):
+    # Written to a temporary file first, so that other processes never read a partial file.
+    temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(temp_path, "w") as f:
+        json.dump(content, f)
+    os.replace(temp_path, path)
+
+
+class JobQueue:
+    """
+    Run the requests in a bounded pool of worker threads, and keep their state for the clients polling it.
+
+    A job is a function called as function(*args, progress=job.progress), returning a JSON serializable result.
+    The finished jobs are kept for result_ttl seconds, then dropped.
+
+    When the server runs in several processes, each has its own queue. With state_dir set (the same for all
+    processes), a job can still be followed and cancelled from any of them, through its state file in state_dir.
+    """
+
+    def __init__(self, max_workers: int = 2, result_ttl: float = 3600, state_dir: str = None):
+        """
+        :param max_workers: The number of jobs running at the same time, the others wait in the queue.
+        :param result_ttl: How long (s) a finished job and its result are kept.
+        :param state_dir: The directory of the state files shared by the processes, None to keep the jobs in memory.
+        """
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, function, *args) -> Job:
+        """Queue function(*args) and return its job at once."""
+        self._drop_expired()
+        job = Job(kind, self.state_dir)
+        with self._lock:
+            self._jobs[job.id] = job
+        job._future = self._executor.submit(self._run, job, function, args)
+        return job
+
+    @staticmethod
+    def _run(job, function, args):
+        if job.cancel_requested():
+            job.set_state(CANCELLED)
+            return
+        job.set_state(RUNNING)
+        try:
+            job.result = function(*args, progress=job.progress)
+            job.set_state(SUCCEEDED)
+        except JobCancelled:
+            job.set_state(CANCELLED)
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.set_state(FAILED)
+
+    def get(self, job_id: str):
+        """Return the job (a SharedJob if run by another process), or None if unknown or expired."""
+        self._drop_expired()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.state_dir is not None:
+            job = self._load_shared(os.path.join(self.state_dir, os.path.basename(job_id) + ".json"))
+        return job
+
+    def jobs(self) -> list:
+        """All the jobs kept, the oldest first."""
+        self._drop_expired()
+        with self._lock:
+            jobs = dict(self._jobs)
+        if self.state_dir is not None:
+            for file_name in os.listdir(self.state_dir):
+                job_id, extension = os.path.splitext(file_name)
+                if extension == ".json" and job_id not in jobs:
+                    job = self._load_shared(os.path.join(self.state_dir, file_name))
+                    if job is not None:
+                        jobs[job_id] = job
+        return sorted(jobs.values(), key=lambda job: job.created_at)
+
+    def _load_shared(self, state_file):
+        try:
+            job = SharedJob(state_file)
+        except (OSError, ValueError):
+            return None
+        if job.finished_at is not None and time.time() - job.finished_at > self.result_ttl:
+            return None
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        Cancel the job: a queued job never starts, a running job stops at its next progress report.
+        Return the job, or None if unknown or expired.
+        """
+        job = self.get(job_id)
+        if job is None or job.state in FINISHED_STATES:
+            return job
+        if isinstance(job, SharedJob):
+            # Stopped by its own process, at its next progress report or when it starts.
+            open(job._state_file + ".cancel", "w").close()
+            return job
+        job._cancel_requested.set()
+        if job._future.cancel():
+            job.set_state(CANCELLED)
+        return job
+
+    def _drop_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and now - job.finished_at > self.result_ttl]
+            for job_id in expired:
+                job = self._jobs.pop(job_id)
+                if job._state_file is not None:
+                    for path in (job._state_file, job._state_file + ".cancel"):
+                        if os.path.exists(path):
+                            os.remove(path)
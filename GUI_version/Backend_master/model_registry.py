@@ -0,0 +1,66 @@
+import os
+import threading
+
+import joblib
+
+
+class ModelRegistry:
+    """
+    Keep the loaded models in memory, so a model file is only deserialized once per process.
+
+    A model is reloaded when its file changes (modification time or size), or when reload() is called.
+    Other files read once and shared by the requests, e.g. tables, can be kept the same way with another loader.
+    """
+
+    def __init__(self, mmap_mode: str = None, loader=None):
+        """
+        :param mmap_mode: Passed to joblib.load, e.g. "r" to memory-map the numpy arrays of the model.
+                          Only has effect for models saved without compression.
+        :param loader: The function called as loader(path) to load a file, None to use joblib.load.
+        """
+        self.mmap_mode = mmap_mode
+        self.loader = loader
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_key(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, model_path: str):
+        """Return the model saved in model_path, loading it if not loaded yet or changed on disk."""
+        path = os.path.abspath(model_path)
+        file_key = self._file_key(path)
+        with self._lock:
+            cached = self._models.get(path)
+            if cached is not None and cached[0] == file_key:
+                return cached[1]
+            if self.loader is None:
+                model = joblib.load(path, mmap_mode=self.mmap_mode)
+            else:
+                model = self.loader(path)
+            self._models[path] = (file_key, model)
+            return model
+
+    def reload(self, model_path: str = None) -> list:
+        """
+        Drop the cached model of model_path (or all models if None) and load them again.
+
+        :return: The paths of the models loaded.
+        """
+        with self._lock:
+            if model_path is None:
+                paths = list(self._models)
+            else:
+                paths = [os.path.abspath(model_path)]
+            for path in paths:
+                self._models.pop(path, None)
+        for path in paths:
+            self.get(path)
+        return paths
+
+    def loaded(self) -> list:
+        """The paths of the models currently in memory."""
+        with self._lock:
+            return list(self._models)
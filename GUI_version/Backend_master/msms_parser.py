@@ -0,0 +1,123 @@
+import re
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+class MSMSArrays(NamedTuple):
+    """
+    The MS/MS spectra of a peak table in CSR layout.
+
+    The peaks of row i are mz[offsets[i]:offsets[i + 1]] and intensity[offsets[i]:offsets[i + 1]],
+    so offsets has one more element than the number of rows.
+    """
+    mz: np.ndarray
+    intensity: np.ndarray
+    offsets: np.ndarray
+
+    @property
+    def n_spectra(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    @property
+    def n_peaks(self) -> np.ndarray:
+        """Number of peaks of each row."""
+        return np.diff(self.offsets)
+
+    def row_index(self) -> np.ndarray:
+        """The row number of every peak in the flat arrays."""
+        return np.repeat(np.arange(self.n_spectra), self.n_peaks)
+
+    def spectrum(self, i: int) -> np.ndarray:
+        """Return row i as a 2-D [[mz, intensity], ...] array."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return np.column_stack((self.mz[start:end], self.intensity[start:end]))
+
+
+_PEAK_PATTERN = re.compile(r"^\s*([^\s:]+)\s*:\s*([^\s:]+)\s*$")
+
+# A well formed spectrum: whitespace separated "mz:int" peaks, each with exactly one ':'.
+_SPECTRUM_PATTERN = r"(?:[^\s:]+:[^\s:]+(?:\s+|$))*"
+
+
+def _parse_spectrum(spectrum):
+    """Parse one spectrum string peak by peak, skipping what can not be read."""
+    mz, intensity = [], []
+    for pair in spectrum.split():
+        match = _PEAK_PATTERN.match(pair)
+        if match is None:
+            continue
+        try:
+            mz_val, intensity_val = float(match.group(1)), float(match.group(2))
+        except ValueError:
+            continue
+        mz.append(mz_val)
+        intensity.append(intensity_val)
+    return mz, intensity
+
+
+def parse_msms_spectra(spectra) -> MSMSArrays:
+    """
+    Parse a column of MS-DIAL spectrum strings ("mz:int mz:int ...") into flat arrays.
+
+    Missing values give an empty spectrum, a trailing ':' is ignored. Malformed peaks are skipped.
+
+    :param spectra: The "MSMS spectrum" column, a pandas Series or any sequence of strings.
+    :return: MSMSArrays with float64 mz and intensity, and int64 offsets.
+    """
+    text = pd.Series(spectra, dtype=object).reset_index(drop=True)
+    text = text.where(text.notna(), "").astype(str).str.strip().str.rstrip(":")
+
+    # Fast path: the well formed rows are converted all at once.
+    fast = text.str.fullmatch(_SPECTRUM_PATTERN).to_numpy(dtype=bool)
+    n_peaks = np.zeros(text.shape[0], dtype=np.int64)
+    n_peaks[fast] = text[fast].str.count(":").to_numpy(dtype=np.int64)
+    try:
+        values = np.array(" ".join(text[fast]).replace(":", " ").split(), dtype=np.float64)
+    except ValueError:
+        # A value is not a number, and which row it is in is not known: parse all rows one by one.
+        fast[:] = False
+        n_peaks[:] = 0
+        values = np.zeros(0, dtype=np.float64)
+
+    # Slow path: the other rows are parsed one by one.
+    slow_rows = {}
+    for i in np.flatnonzero(~fast):
+        slow_rows[i] = _parse_spectrum(text[i])
+        n_peaks[i] = len(slow_rows[i][0])
+
+    offsets = np.zeros(text.shape[0] + 1, dtype=np.int64)
+    np.cumsum(n_peaks, out=offsets[1:])
+    if not slow_rows:
+        return MSMSArrays(mz=values[0::2].copy(), intensity=values[1::2].copy(), offsets=offsets)
+
+    # The peaks of the fast rows are in row order, move each row to its offset.
+    mz = np.empty(offsets[-1], dtype=np.float64)
+    intensity = np.empty(offsets[-1], dtype=np.float64)
+    fast_start = np.cumsum(n_peaks[fast]) - n_peaks[fast]
+    position = np.arange(values.shape[0] // 2) + np.repeat(offsets[:-1][fast] - fast_start, n_peaks[fast])
+    mz[position] = values[0::2]
+    intensity[position] = values[1::2]
+    for i, (row_mz, row_intensity) in slow_rows.items():
+        mz[offsets[i]:offsets[i + 1]] = row_mz
+        intensity[offsets[i]:offsets[i + 1]] = row_intensity
+    return MSMSArrays(mz=mz, intensity=intensity, offsets=offsets)
+
+
+def neutral_loss_spectra(spectra: MSMSArrays, precursor) -> MSMSArrays:
+    """
+    Build the neutral loss spectra (precursor m/z - fragment m/z, rounded to 5 decimals) of all rows.
+
+    Only the fragments lighter than the precursor are kept, with their intensity.
+
+    :param spectra: The MS/MS spectra.
+    :param precursor: The precursor m/z of each row.
+    """
+    precursor = np.asarray(precursor, dtype=np.float64)
+    row = spectra.row_index()
+    loss = precursor[row] - spectra.mz
+    keep = loss > 0
+    offsets = np.zeros(spectra.n_spectra + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row[keep], minlength=spectra.n_spectra), out=offsets[1:])
+    return MSMSArrays(mz=np.round(loss[keep], 5), intensity=spectra.intensity[keep], offsets=offsets)
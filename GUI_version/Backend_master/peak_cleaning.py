@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+_ADDUCT_LINK_PATTERN = r"adduct linked to ([^_;]*)"
+
+
+def resolve_adducts(peak_id, comment, area) -> np.ndarray:
+    """
+    Keep only the largest peak among peaks that MS-DIAL marked as adducts of each other.
+
+    The "adduct linked to <PeakID>_<adduct>" notes in the comments are read into an edge list, the linked peaks are
+    grouped into connected components, and in each component only the peaks with the largest area are kept.
+    Links to peaks not in the table are ignored.
+
+    :param peak_id: PeakID of the peaks.
+    :param comment: MS-DIAL comment of the peaks.
+    :param area: Peak area of the peaks.
+    :return: A boolean mask, True for the peaks to keep.
+    """
+    peak_id = pd.Series(peak_id).astype(str).str.strip().reset_index(drop=True)
+    comment = pd.Series(comment).astype(str).reset_index(drop=True)
+    area = pd.Series(area, dtype=np.float64).reset_index(drop=True)
+    n = peak_id.shape[0]
+
+    links = comment.str.extractall(_ADDUCT_LINK_PATTERN)
+    if links.empty:
+        return np.ones(n, dtype=bool)
+    edges = pd.DataFrame({"source": links.index.get_level_values(0), "id": links[0].str.strip().to_numpy()})
+    edges = edges.merge(pd.DataFrame({"id": peak_id, "target": np.arange(n)}), on="id")
+
+    graph = coo_matrix((np.ones(edges.shape[0], dtype=np.int8), (edges["source"], edges["target"])), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+    max_area = area.groupby(component).transform("max")
+    return ~(area < max_area).to_numpy()
+
+
+def group_duplicate_peaks(mz, rt, area, mz_threshold: float, rt_threshold: float) -> np.ndarray:
+    """
+    Group duplicated peaks and keep the peak with the largest area of each group.
+
+    The peaks need to be sorted by m/z. The first peak not yet grouped is used as the seed, every peak not yet
+    grouped within mz_threshold and rt_threshold of the seed joins its group. As the seed always has the lowest m/z
+    left, only the peaks in [seed m/z, seed m/z + mz_threshold] need to be checked, which are found by binary search.
+
+    :param mz: Precursor m/z of the peaks, sorted in ascending order.
+    :param rt: Retention time of the peaks.
+    :param area: Peak area of the peaks.
+    :param mz_threshold: The m/z tolerance in Da.
+    :param rt_threshold: The retention time tolerance in min.
+    :return: The positions of the kept peaks, one for each group, in the order the groups were found.
+    """
+    mz = np.asarray(mz, dtype=np.float64)
+    rt = np.asarray(rt, dtype=np.float64)
+    area = np.asarray(area, dtype=np.float64)
+    n = mz.shape[0]
+    if n > 1 and np.any(mz[1:] < mz[:-1]):
+        raise ValueError("The peaks need to be sorted by m/z!")
+
+    # The window end of each seed, widened by one ulp and checked again below with the exact condition.
+    window_end = np.searchsorted(mz, np.nextafter(mz + mz_threshold, np.inf), side="right")
+
+    grouped = np.zeros(n, dtype=bool)
+    kept = []
+    for i in range(n):
+        if grouped[i]:
+            continue
+        end = window_end[i]
+        if end == i + 1:
+            # Only the seed itself in the m/z window.
+            grouped[i] = True
+            kept.append(i)
+            continue
+
+        candidates = np.arange(i, end)
+        in_group = (~grouped[i:end]) & \
+                   (np.abs(mz[i:end] - mz[i]) <= mz_threshold) & \
+                   (np.abs(rt[i:end] - rt[i]) <= rt_threshold)
+        members = candidates[in_group]
+        grouped[members] = True
+        # The first one is used when several peaks have the same largest area.
+        kept.append(members[np.argmax(area[members])])
+
+    return np.array(kept, dtype=np.int64)
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class PMDIndex:
+    """
+    Sorted index of the PMD (paired mass distance) table, to match many mass differences at once.
+
+    A mass difference matches a PMD row when abs(PMD mass - abs(mass difference)) <= ms_threshold. When several rows
+    match, the first one in table order is used, as the row by row scan of the table did.
+    The index can also be used as the pair_filter of id_network.iter_network_edges.
+    """
+
+    def __init__(self, pmd_masses, ms_threshold: float):
+        """
+        :param pmd_masses: The "Mass Difference (Da)" column of the PMD table.
+        :param ms_threshold: The m/z tolerance in Da.
+        """
+        pmd_masses = np.asarray(pmd_masses, dtype=np.float64)
+        # Rows without a mass never match.
+        row = np.flatnonzero(~np.isnan(pmd_masses))
+        order = np.argsort(pmd_masses[row], kind="stable")
+        self.row = row[order]
+        self.mass = pmd_masses[self.row]
+        self.ms_threshold = ms_threshold
+
+    def match(self, mass_difference) -> np.ndarray:
+        """
+        Find the PMD row matching each mass difference.
+
+        :param mass_difference: The precursor mass differences, the sign is ignored.
+        :return: The position of the matched row in the PMD table, -1 for no match.
+        """
+        mass_difference = np.abs(np.asarray(mass_difference, dtype=np.float64)).ravel()
+        matched = np.full(mass_difference.shape[0], -1, dtype=np.int64)
+        if self.mass.shape[0] == 0 or mass_difference.shape[0] == 0:
+            return matched
+
+        # The windows are widened by one ulp and checked again below with the exact condition.
+        start = np.searchsorted(self.mass, np.nextafter(mass_difference - self.ms_threshold, -np.inf), side="left")
+        end = np.searchsorted(self.mass, np.nextafter(mass_difference + self.ms_threshold, np.inf), side="right")
+
+        # Go through the k-th row of every window at once, the windows only hold a few rows.
+        for k in range(int((end - start).max(initial=0))):
+            position = start + k
+            in_window = np.flatnonzero(position < end)
+            position = position[in_window]
+            hit = np.abs(self.mass[position] - mass_difference[in_window]) <= self.ms_threshold
+            in_window, row = in_window[hit], self.row[position[hit]]
+            better = (matched[in_window] < 0) | (row < matched[in_window])
+            matched[in_window[better]] = row[better]
+        return matched
+
+    def __call__(self, mass_difference) -> np.ndarray:
+        """Return True for the mass differences matching a PMD row."""
+        return self.match(mass_difference) >= 0
+
+    def annotate(self, mass_difference, pmd_table, columns=("Reaction", "Description")) -> dict:
+        """
+        Take the columns of the matched PMD rows for each mass difference, None where nothing matches.
+
+        :param mass_difference: The precursor mass differences.
+        :param pmd_table: The PMD table the index was built from.
+        :param columns: The columns of pmd_table to take.
+        :return: A dict of column name to object array.
+        """
+        matched = self.match(mass_difference)
+        found = matched >= 0
+        annotations = {}
+        for column in columns:
+            values = np.full(matched.shape[0], None, dtype=object)
+            values[found] = pmd_table[column].to_numpy(dtype=object)[matched[found]]
+            annotations[column] = values
+        return annotations
@@ -0,0 +1,23 @@
+"""
+Build the Cython extension spectral_entropy/tools_fast in place:
+
+    python setup.py build_ext --inplace
+
+The extension is built from tools_fast.pyx when Cython is installed, otherwise from the generated tools_fast.c.
+Without this step, spectral_entropy uses its pure Python implementation, or builds the extension on first import
+with pyximport when SPECTRAL_ENTROPY_BUILD=1 is set and Cython is installed.
+"""
+import numpy as np
+from setuptools import Extension, setup
+
+try:
+    from Cython.Build import cythonize
+    ext_modules = cythonize("spectral_entropy/tools_fast.pyx")
+except ImportError:
+    ext_modules = [Extension("spectral_entropy.tools_fast", ["spectral_entropy/tools_fast.c"])]
+
+setup(
+    name="spectral_entropy_tools_fast",
+    ext_modules=ext_modules,
+    include_dirs=[np.get_include()],
+)
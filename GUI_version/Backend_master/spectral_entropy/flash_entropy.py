@@ -0,0 +1,161 @@
+import numpy as np
+from typing import Union
+
+from .tools import check_spectrum, clean_spectrum, clean_spectra_batch
+
+# The same intensity weighting as math_distance.entropy_distance.
+WEIGHT_START = 0.25
+ENTROPY_CUTOFF = 3
+
+
+def _weight_intensity_by_entropy(intensity, offsets):
+    """
+    Weight the intensity of each spectrum of a ragged batch by its spectral entropy, and normalize each spectrum to
+    have intensity sum = 1.
+    """
+    n_spectra = offsets.shape[0] - 1
+    row = np.repeat(np.arange(n_spectra), np.diff(offsets))
+    intensity = np.asarray(intensity, dtype=np.float64)
+
+    intensity_sum = np.bincount(row, weights=intensity, minlength=n_spectra)
+    intensity = intensity / np.where(intensity_sum > 0, intensity_sum, 1)[row]
+    entropy = -np.bincount(row, weights=_x_log_x(intensity), minlength=n_spectra)
+
+    weight_slope = (1 - WEIGHT_START) / ENTROPY_CUTOFF
+    weight = np.where(entropy < ENTROPY_CUTOFF, WEIGHT_START + weight_slope * entropy, 1.)
+    intensity = np.power(intensity, weight[row])
+    intensity_sum = np.bincount(row, weights=intensity, minlength=n_spectra)
+    return intensity / np.where(intensity_sum > 0, intensity_sum, 1)[row]
+
+
+def _x_log_x(x):
+    result = np.zeros_like(x)
+    positive = x > 0
+    result[positive] = x[positive] * np.log(x[positive])
+    return result
+
+
+class FlashEntropyIndex:
+    """
+    Inverted index of the fragments of many spectra, for entropy similarity search.
+
+    For two spectra P and Q with entropy weighted intensities summing to 1, the entropy similarity only depends on
+    the matched peaks:
+
+        similarity = sum over matched peaks of ((p + q) * ln(p + q) - p * ln(p) - q * ln(q)) / ln(4)
+
+    So the fragments of all library spectra, with their weighted intensities, are kept in one array sorted by m/z.
+    The similarity of a query with every library spectrum is accumulated from the library peaks found by binary search
+    around each query peak, without comparing the spectra one by one.
+
+    The result is the same as calculate_entropy_similarity and the "entropy" method of similarity, as long as there are
+    no two peaks of a spectrum within the tolerance of one peak of the other spectrum. This is always the case when the
+    peaks of the spectra are more than 2 * ms2_da apart.
+    """
+
+    def __init__(self, spectra: list, precursor_mz=None,
+                 ms2_ppm: float = None, ms2_da: float = None,
+                 need_clean_spectra: bool = True, noise_removal: float = 0.01):
+        """
+        If both ms2_ppm and ms2_da is defined, ms2_da will be used.
+
+        :param spectra: The library spectra, each one in 2-D list or 2-D numpy array.
+        :param precursor_mz: The precursor m/z of each library spectrum, needed for the neutral loss search.
+        :param ms2_ppm: The MS/MS tolerance in ppm.
+        :param ms2_da: The MS/MS tolerance in Da.
+        :param need_clean_spectra: Clean the library spectra, required for not normalized spectrum.
+        :param noise_removal: The ions with intensity lower than max ion's intensity * noise_removal will be removed.
+        """
+        if ms2_ppm is None and ms2_da is None:
+            raise ValueError("MS2 tolerance need to be defined!")
+        self.ms2_ppm = ms2_ppm
+        self.ms2_da = ms2_da
+        self.noise_removal = noise_removal
+        self.n_spectra = len(spectra)
+
+        spectra = [check_spectrum(spectrum) for spectrum in spectra]
+        offsets = np.zeros(self.n_spectra + 1, dtype=np.int64)
+        np.cumsum([spectrum.shape[0] for spectrum in spectra], out=offsets[1:])
+        mz = np.concatenate([spectrum[:, 0] for spectrum in spectra] + [np.zeros(0, dtype=np.float32)])
+        intensity = np.concatenate([spectrum[:, 1] for spectrum in spectra] + [np.zeros(0, dtype=np.float32)])
+        if need_clean_spectra:
+            mz, intensity, offsets = clean_spectra_batch(mz, intensity, offsets, noise_removal=noise_removal,
+                                                         ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+
+        mz = mz.astype(np.float64)
+        intensity = _weight_intensity_by_entropy(intensity, offsets)
+        spectrum_index = np.repeat(np.arange(self.n_spectra), np.diff(offsets))
+
+        self._fragment_index = self._sort_by_mz(mz, intensity, spectrum_index)
+        if precursor_mz is not None:
+            precursor_mz = np.asarray(precursor_mz, dtype=np.float64)
+            self._neutral_loss_index = self._sort_by_mz(precursor_mz[spectrum_index] - mz, intensity, spectrum_index)
+        else:
+            self._neutral_loss_index = None
+
+    @staticmethod
+    def _sort_by_mz(mz, intensity, spectrum_index):
+        order = np.argsort(mz, kind="stable")
+        return mz[order], intensity[order], spectrum_index[order]
+
+    def search(self, spectrum_query: Union[list, np.ndarray], precursor_mz: float = None,
+               method: str = "fragment", need_clean_spectra: bool = True) -> np.ndarray:
+        """
+        Calculate the entropy similarity between the query and every library spectrum.
+
+        :param spectrum_query: The query spectrum, need to be in numpy array format.
+        :param precursor_mz: The precursor m/z of the query, needed for the neutral loss search.
+        :param method: "fragment" to match the fragments, "neutral_loss" to match the neutral losses.
+        :param need_clean_spectra: Clean the query spectrum, required for not normalized spectrum.
+        :return: The similarity with each library spectrum, in the order of the library.
+        """
+        spectrum_query = check_spectrum(spectrum_query)
+        if need_clean_spectra:
+            spectrum_query = clean_spectrum(spectrum_query, noise_removal=self.noise_removal,
+                                            ms2_ppm=self.ms2_ppm, ms2_da=self.ms2_da)
+        query_mz = spectrum_query[:, 0].astype(np.float64)
+        query_intensity = _weight_intensity_by_entropy(spectrum_query[:, 1],
+                                                       np.array([0, spectrum_query.shape[0]]))
+
+        if method == "fragment":
+            index = self._fragment_index
+        elif method == "neutral_loss":
+            if self._neutral_loss_index is None or precursor_mz is None:
+                raise ValueError("The precursor m/z is needed for the neutral loss search!")
+            index = self._neutral_loss_index
+            query_mz = precursor_mz - query_mz
+        else:
+            raise ValueError("Method name: {} error!".format(method))
+
+        order = np.argsort(query_mz, kind="stable")
+        return self._accumulate_similarity(query_mz[order], query_intensity[order], *index)
+
+    def _accumulate_similarity(self, query_mz, query_intensity, index_mz, index_intensity, index_spectrum):
+        similarity = np.zeros(self.n_spectra, dtype=np.float64)
+        if query_mz.shape[0] == 0 or index_mz.shape[0] == 0:
+            return similarity
+
+        if self.ms2_da is not None:
+            tolerance = self.ms2_da
+        else:
+            tolerance = query_mz * self.ms2_ppm * 1e-6
+        start = np.searchsorted(index_mz, query_mz - tolerance, side="left")
+        end = np.searchsorted(index_mz, query_mz + tolerance, side="right")
+        n_matched = end - start
+        if n_matched.sum() == 0:
+            return similarity
+        query_peak = np.repeat(np.arange(query_mz.shape[0]), n_matched)
+        position = np.repeat(start - np.cumsum(n_matched) + n_matched, n_matched) + np.arange(n_matched.sum())
+
+        # A library peak within the tolerance of several query peaks is matched to the one with the lowest m/z,
+        # as match_peaks_in_spectra does. The query peaks are sorted, so this is the first occurrence.
+        position, first = np.unique(position, return_index=True)
+        query_peak = query_peak[first]
+
+        # The library peaks of one spectrum matched to the same query peak are merged.
+        key, inverse = np.unique(query_peak * self.n_spectra + index_spectrum[position], return_inverse=True)
+        q = np.bincount(inverse, weights=index_intensity[position])
+        p = query_intensity[key // self.n_spectra]
+        contribution = (_x_log_x(p + q) - _x_log_x(p) - _x_log_x(q)) / np.log(4)
+        similarity += np.bincount(key % self.n_spectra, weights=contribution, minlength=self.n_spectra)
+        return np.clip(similarity, 0, 1)
@@ -0,0 +1,153 @@
+import numpy as np
+from typing import Union
+
+from .spectral_similarity import _distance_of_methods
+from .tools import check_spectrum, clean_spectrum, clean_spectra_batch
+
+
+def read_msp(file_path: str) -> list:
+    """
+    Read the spectra of a MSP file.
+
+    :param file_path: The path of the MSP file.
+    :return: A list of dict, one for each spectrum, with the fields of the file (e.g. "Name", "PrecursorMZ") and
+             "peaks", the spectrum as a 2-D numpy array.
+    """
+    spectra = []
+    info, peaks = {}, []
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                if info or peaks:
+                    info["peaks"] = np.array(peaks, dtype=np.float32).reshape(-1, 2)
+                    spectra.append(info)
+                info, peaks = {}, []
+                continue
+            if ":" in line and not line[0].isdigit():
+                key, value = line.split(":", 1)
+                info[key.strip()] = value.strip()
+            else:
+                values = line.replace("\t", " ").split()
+                if len(values) >= 2:
+                    peaks.append([float(values[0]), float(values[1])])
+    if info or peaks:
+        info["peaks"] = np.array(peaks, dtype=np.float32).reshape(-1, 2)
+        spectra.append(info)
+    return spectra
+
+
+class SpectralLibrary:
+    """
+    A set of reference spectra, cleaned once and indexed by fragment m/z, to compare a query with all of them.
+
+    All fragments of the references are kept in one array sorted by m/z. For a query, the references sharing at least
+    one fragment with it (within the MS/MS tolerance) are found by binary search, and only those are compared.
+    """
+
+    def __init__(self, spectra: list, ms2_ppm: float = None, ms2_da: float = None,
+                 need_clean_spectra: bool = True, metadata: list = None):
+        """
+        If both ms2_ppm and ms2_da is defined, ms2_da will be used.
+
+        :param spectra: The reference spectra, each one in 2-D list or 2-D numpy array.
+        :param ms2_ppm: The MS/MS tolerance in ppm.
+        :param ms2_da: The MS/MS tolerance in Da.
+        :param need_clean_spectra: Clean the reference spectra, required for not normalized spectrum.
+        :param metadata: Optional information of each reference, e.g. the records of read_msp.
+        """
+        if ms2_ppm is None and ms2_da is None:
+            raise ValueError("MS2 tolerance need to be defined!")
+        self.ms2_ppm = ms2_ppm
+        self.ms2_da = ms2_da
+        self.metadata = metadata
+
+        spectra = [check_spectrum(spectrum) for spectrum in spectra]
+        offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+        np.cumsum([spectrum.shape[0] for spectrum in spectra], out=offsets[1:])
+        mz = np.concatenate([spectrum[:, 0] for spectrum in spectra] + [np.zeros(0, dtype=np.float32)])
+        intensity = np.concatenate([spectrum[:, 1] for spectrum in spectra] + [np.zeros(0, dtype=np.float32)])
+        if need_clean_spectra:
+            mz, intensity, offsets = clean_spectra_batch(mz, intensity, offsets, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+
+        self.spectra = [np.column_stack((mz[start:end], intensity[start:end]))
+                        for start, end in zip(offsets[:-1], offsets[1:])]
+
+        # The fragments of all references, sorted by m/z.
+        spectrum_index = np.repeat(np.arange(len(spectra)), np.diff(offsets))
+        order = np.argsort(mz, kind="stable")
+        self.fragment_mz = mz[order]
+        self.fragment_spectrum = spectrum_index[order]
+
+    @classmethod
+    def from_msp(cls, file_path: str, ms2_ppm: float = None, ms2_da: float = None,
+                 need_clean_spectra: bool = True) -> "SpectralLibrary":
+        """Build the library from a MSP file, the records of read_msp are kept as metadata."""
+        records = read_msp(file_path)
+        return cls([record["peaks"] for record in records], ms2_ppm=ms2_ppm, ms2_da=ms2_da,
+                   need_clean_spectra=need_clean_spectra, metadata=records)
+
+    def __len__(self):
+        return len(self.spectra)
+
+    def candidates(self, spectrum_query: Union[list, np.ndarray]) -> np.ndarray:
+        """
+        Find the references sharing at least one fragment with the query, within the MS/MS tolerance.
+
+        :param spectrum_query: The query spectrum, need to be in numpy array format.
+        :return: The index of the references, in ascending order.
+        """
+        query_mz = check_spectrum(spectrum_query)[:, 0].astype(np.float64)
+        if query_mz.shape[0] == 0 or self.fragment_mz.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.ms2_da is not None:
+            tolerance = self.ms2_da
+        else:
+            tolerance = query_mz * self.ms2_ppm * 1e-6
+        # The windows are widened by one ulp so that no fragment at the tolerance edge is missed.
+        start = np.searchsorted(self.fragment_mz, np.nextafter(query_mz - tolerance, -np.inf), side="left")
+        end = np.searchsorted(self.fragment_mz, np.nextafter(query_mz + tolerance, np.inf), side="right")
+        n_fragments = end - start
+        if n_fragments.sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+        position = np.repeat(start - np.cumsum(n_fragments) + n_fragments, n_fragments) + \
+            np.arange(n_fragments.sum())
+        return np.unique(self.fragment_spectrum[position])
+
+    def search(self, spectrum_query: Union[list, np.ndarray], method: str = "entropy",
+               need_clean_spectra: bool = True, need_normalize_result: bool = True,
+               prune: bool = True, fill_value: float = 0.) -> np.ndarray:
+        """
+        Calculate the similarity between the query and every reference of the library.
+
+        :param spectrum_query: The query spectrum, need to be in numpy array format.
+        :param method: The similarity method, one of the methods of spectral_entropy.similarity.
+        :param need_clean_spectra: Clean the query spectrum, required for not normalized spectrum.
+        :param need_normalize_result: Normalize the result into [0,1].
+        :param prune: Only compare the references sharing a fragment with the query, the others get fill_value.
+                      Meant for methods giving no similarity to spectra without common peaks, e.g. "entropy",
+                      "dot_product" or "ms_for_id_v1".
+        :param fill_value: The similarity given to the references not compared.
+        :return: The similarity with each reference, in the order of the library.
+        """
+        spectrum_query = np.asarray(spectrum_query, dtype=np.float32)
+        if need_clean_spectra:
+            spectrum_query = clean_spectrum(spectrum_query, ms2_ppm=self.ms2_ppm, ms2_da=self.ms2_da)
+
+        if prune:
+            candidates = self.candidates(spectrum_query)
+            result = np.full(len(self.spectra), fill_value, dtype=np.float64)
+        else:
+            candidates = np.arange(len(self.spectra))
+            result = np.zeros(len(self.spectra), dtype=np.float64)
+
+        for i in candidates:
+            dist = _distance_of_methods(spectrum_query=spectrum_query, spectrum_library=self.spectra[i],
+                                        methods=[method],
+                                        need_clean_spectra=False, need_normalize_result=need_normalize_result,
+                                        ms2_ppm=self.ms2_ppm, ms2_da=self.ms2_da)[method]
+            if need_normalize_result:
+                result[i] = 1 - dist
+            else:
+                result[i] = 0 - dist
+        return result
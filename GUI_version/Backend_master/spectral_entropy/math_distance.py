@@ -31,13 +31,14 @@ def entropy_distance(p, q):
     return unweighted_entropy_distance(p, q)
 
 
-def _weight_intensity_by_entropy(x):
+def _weight_intensity_by_entropy(x, entropy_x=None):
     WEIGHT_START = 0.25
     ENTROPY_CUTOFF = 3
     weight_slope = (1 - WEIGHT_START) / ENTROPY_CUTOFF
 
     if np.sum(x) > 0:
-        entropy_x = scipy.stats.entropy(x)
+        if entropy_x is None:
+            entropy_x = scipy.stats.entropy(x)
         if entropy_x < ENTROPY_CUTOFF:
             weight = WEIGHT_START + weight_slope * entropy_x
             x = np.power(x, weight)
@@ -48,10 +48,10 @@ def ms_for_id_v1_distance(spec_query, spec_reference, ms2_ppm=None, ms2_da=None)
     """
 
     spec_matched = match_peaks_in_spectra(spec_a=spec_query, spec_b=spec_reference, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+    return _ms_for_id_v1_distance_on_matched_peaks(spec_matched[:, 1], spec_matched[:, 2])
 
-    i_q = spec_matched[:, 1]
-    i_r = spec_matched[:, 2]
 
+def _ms_for_id_v1_distance_on_matched_peaks(i_q, i_r):
     n_m = np.sum(np.bitwise_and(i_q > 0, i_r > 0))
     n_q = np.sum(i_q > 0)
     n_r = np.sum(i_r > 0)
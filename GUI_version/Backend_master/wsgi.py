@@ -0,0 +1,20 @@
+"""
+WSGI entry point of the backend for production servers, e.g. gunicorn (see gunicorn.conf.py) or waitress on Windows.
+
+The default Finder model and the PMD and virtual nodes tables are loaded when this module is imported. With
+gunicorn's preload_app, this is done once in the master process before the workers are forked, so that the workers
+share these pages copy-on-write instead of each loading its own copy.
+"""
+import gc
+import os
+
+# The default paths of the models and tables (./Finder, ./ID) are relative to the backend directory.
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app as application, preload  # noqa: E402
+
+preload()
+
+# The objects loaded so far live as long as the server: keep them out of the garbage collector, whose passes would
+# otherwise write to (and so copy) their pages in every worker.
+gc.freeze()
@@ -1,151 +1,182 @@
-from flask import Flask, request, jsonify
+import json
+import multiprocessing
+from flask import Flask, Response, request, jsonify
 import pandas as pd
 import numpy as np
 import spectral_entropy
-import joblib
-from tqdm import tqdm
 import os
+import time
+import table_io
+from job_queue import FINISHED_STATES, JobQueue
+from model_registry import ModelRegistry
+from msms_parser import MSMSArrays, neutral_loss_spectra, parse_msms_spectra
+from id_network import iter_network_edges
+from pmd_index import PMDIndex
+from finder_batch import expand_file_paths, sample_name, screen_files
+from finder_features import bin_spectra_sparse, predict_bins
+from peak_cleaning import group_duplicate_peaks, resolve_adducts
 
 app = Flask(__name__)
 
-def process_id_logic(peak_table, nodes_table, pmd_table, similarity_threshold, ms_threshold):
-    """ID_GUI 的核心处理逻辑"""
-    # 移除 MSMS spectrum 列中的尾随冒号
-    peak_table['MSMS spectrum'] = peak_table['MSMS spectrum'].str.rstrip(':')
-    
-    # 处理质谱数据的函数
-    def process_spectrum(spectrum):
-        if isinstance(spectrum, float):
-            return {}
-        return dict((float(mz.split(':')[0]), float(mz.split(':')[1])) 
-                   for mz in spectrum.split(' '))
-    
-    # 创建 MSMS 字典
-    peak_table['MSMS_dict'] = peak_table['MSMS spectrum'].apply(process_spectrum)
-    
-    # 计算中性损失
-    peak_table['NL_spectrum'] = peak_table.apply(
-        lambda row: {
-            round(row['Precursor m/z'] - mz, 5): intensity 
-            for mz, intensity in row['MSMS_dict'].items() 
-            if row['Precursor m/z'] - mz > 0
-        }, 
-        axis=1
+# 默认的 Finder 模型和 ID 使用的表
+FINDER_MODEL_PATH = './Finder/Fentanyl_Finder.pkl'
+NODES_TABLE_PATH = './ID/Virtual_nodes.xlsx'
+PMD_TABLE_PATH = './ID/PMD.xlsx'
+
+# 进程内缓存已加载的模型，避免每次请求重新反序列化
+model_registry = ModelRegistry()
+
+# 进程内缓存 PMD 表和虚拟节点表，避免每次请求重新读取 Excel；表在请求间共享，不能修改
+table_registry = ModelRegistry(loader=pd.read_excel)
+
+# 进程内缓存清洗后的谱图，重复运行 ID（如调整相似度阈值）时不再重复清洗；设置 SPECTRUM_CACHE_DIR 时同时缓存到磁盘
+spectrum_cache = spectral_entropy.SpectrumCache(cache_dir=os.environ.get("SPECTRUM_CACHE_DIR"))
+
+# 后台任务队列：JOB_WORKERS 个任务同时运行，结束的任务及结果保留 JOB_RESULT_TTL 秒
+# 多进程运行时设置 JOB_STATE_DIR（所有进程相同），任务状态保存到该目录，任意进程都能查询和取消任务
+job_queue = JobQueue(max_workers=int(os.environ.get("JOB_WORKERS", 2)),
+                     result_ttl=float(os.environ.get("JOB_RESULT_TTL", 3600)),
+                     state_dir=os.environ.get("JOB_STATE_DIR"))
+
+def _no_progress(stage, done=None, total=None):
+    pass
+
+def _preloaded_files():
+    return (
+        ('finder_model', model_registry, FINDER_MODEL_PATH),
+        ('pmd_table', table_registry, PMD_TABLE_PATH),
+        ('virtual_nodes', table_registry, NODES_TABLE_PATH),
     )
+
+def preload(verbose=True):
+    """加载默认的 Finder 模型、PMD 表和虚拟节点表，已加载且文件未修改时不重新加载，返回每个文件是否已加载
+
+    多进程服务器 (gunicorn preload_app) 在 fork 工作进程之前调用，工作进程以写时复制方式共享这些内存；
+    其他启动方式（flask run、run_flask_server.bat）在第一次就绪检查时加载
+    verbose: 打印加载的文件和找不到的文件
+    """
+    loaded = {}
+    for name, registry, path in _preloaded_files():
+        if not os.path.exists(path):
+            loaded[name] = False
+            if verbose:
+                print(f"Warning: {name} not found: {path}")
+            continue
+        registry.get(path)
+        loaded[name] = True
+        if verbose:
+            print(f"Preloaded {name}: {path}")
+    return loaded
+
+def process_id_logic(peak_table, nodes_table, pmd_table, similarity_threshold, ms_threshold,
+                     n_seeds=None, max_mass_difference=None, pmd_prefilter=False, n_workers=None,
+                     spectrum_cache=None, progress=None):
+    """ID_GUI 的核心处理逻辑
+
+    n_seeds: 只比较前 n_seeds 个节点与其他节点，None 表示计算全部节点对
+    max_mass_difference: 只比较质量差不超过该值 (Da) 的节点对，None 表示不限制
+    pmd_prefilter: 只比较质量差与 PMD 表匹配的节点对
+    n_workers: 计算相似度的进程数，None 表示使用 ID_WORKERS 个进程（默认为 CPU 数，最多 4 个）
+    spectrum_cache: spectral_entropy.SpectrumCache，复用已清洗的谱图，None 表示每次重新清洗
+    progress: 进度回调 progress(stage, done, total)，None 表示不报告进度
+    """
+    if progress is None:
+        progress = _no_progress
     
-    # 转换中性损失为字符串格式
-    peak_table['NL_spectrum_str'] = peak_table['NL_spectrum'].apply(
-        lambda x: ' '.join([f'{mz}:{intensity}' for mz, intensity in x.items()])
-    )
+    # 一次性解析所有 MS/MS 谱图
+    n_rows = len(peak_table)
+    progress("parse spectra", 0, n_rows)
+    spectra = parse_msms_spectra(peak_table['MSMS spectrum'])
+    has_spectrum = peak_table['MSMS spectrum'].notna().to_numpy()
+    progress("parse spectra", n_rows, n_rows)
+    
+    # 计算中性损失谱
+    progress("neutral loss spectra", 0, n_rows)
+    precursor_all = peak_table["Precursor m/z"].to_numpy(dtype=np.float64)
+    NL_spectra = neutral_loss_spectra(spectra, precursor_all)
+    progress("neutral loss spectra", n_rows, n_rows)
+    
+    # 一次性清洗所有 MS2 谱图和中性损失谱，有缓存时只清洗缓存中没有的谱图
+    progress("clean spectra", 0, 2 * n_rows)
+    clean_spectra_batch = spectral_entropy.clean_spectra_batch if spectrum_cache is None \
+        else spectrum_cache.clean_spectra_batch
+    clean_ms2 = MSMSArrays(*clean_spectra_batch(
+        spectra.mz, spectra.intensity, spectra.offsets,
+        max_mz=800, 
+        noise_removal=0.01, 
+        ms2_da=0.01
+    ))
+    clean_NL = MSMSArrays(*clean_spectra_batch(
+        NL_spectra.mz, NL_spectra.intensity, NL_spectra.offsets,
+        max_mz=precursor_all, 
+        noise_removal=0.01, 
+        ms2_da=0.01
+    ))
+    progress("clean spectra", 2 * n_rows, 2 * n_rows)
     
-    # 创建节点表
-    nodetable1 = pd.DataFrame(columns=["precursor", "RT", "PeakID", "ms2_data", "NL_data"])
-    
-    # 处理每一行数据
-    for _, row in peak_table.iterrows():
-        if not pd.isna(row["MSMS spectrum"]):
-            precursor = row["Precursor m/z"]
-            ms2_data = row["MSMS spectrum"]
-            PeakID = row["PeakID"]
-            RT = row["RT (min)"]
-            
-            # 处理 MS2 数据
-            ms2_df = pd.DataFrame([
-                entry.split(':') for entry in ms2_data.split(" ")
-            ], columns=["mz", "intensity"]).astype(float)
-            
-            clean_spectrum = spectral_entropy.clean_spectrum(
-                ms2_df.to_numpy(), 
-                max_mz=800, 
-                noise_removal=0.01, 
-                ms2_da=0.01
-            )
-            
-            # 处理中性损失数据
-            NL_data = row["NL_spectrum_str"]
-            NL_df = pd.DataFrame([
-                entry.split(':') for entry in NL_data.split()
-            ], columns=["mz", "intensity"]).astype(float)
-            
-            clean_NL_spectrum = spectral_entropy.clean_spectrum(
-                NL_df.to_numpy(), 
-                max_mz=precursor, 
-                noise_removal=0.01, 
-                ms2_da=0.01
-            )
-            
-            # 添加到节点表
-            new_row = pd.DataFrame([{
-                "precursor": precursor,
-                "RT": RT,
-                "PeakID": PeakID,
-                "ms2_data": clean_spectrum,
-                "NL_data": clean_NL_spectrum
-            }])
-            nodetable1 = pd.concat([nodetable1, new_row], ignore_index=True)
+    # 创建节点表：按列收集数据，最后一次性生成 DataFrame
+    rows = np.flatnonzero(has_spectrum)
+    precursor_list = precursor_all[rows]
+    ms2_data_list = np.empty(rows.shape[0], dtype=object)
+    NL_data_list = np.empty(rows.shape[0], dtype=object)
+    for k, i in enumerate(rows):
+        ms2_data_list[k] = clean_ms2.spectrum(i)
+        NL_data_list[k] = clean_NL.spectrum(i)
+    
+    nodetable1 = pd.DataFrame({
+        "precursor": precursor_list,
+        "RT": peak_table["RT (min)"].to_numpy()[rows],
+        "PeakID": peak_table["PeakID"].to_numpy()[rows],
+        "ms2_data": ms2_data_list,
+        "NL_data": NL_data_list
+    })
     
     # 移除缺失 ms2_data 的行
     nodetable1 = nodetable1.dropna(subset=['ms2_data'])
     
-    # 计算相似度
-    similarity_results = []
-    max_index = max(nodetable1.index)
-    
-    # 只处理前两行数据
-    for index_a, row_a in nodetable1.iterrows():
-        if index_a >= 2:  # 只处理前两行数据
-            break
-            
-        for index_b in range(index_a + 1, max_index + 1):
-            if index_b in nodetable1.index:
-                row_b = nodetable1.loc[index_b]
-                
-                # 计算基本信息
-                mass_difference = row_b["precursor"] - row_a["precursor"]
-                
-                # 计算 MS2 相似度
-                ms2_sim = spectral_entropy.all_similarity(
-                    pd.DataFrame(row_a["ms2_data"], columns=["mz", "intensity"]).to_numpy(),
-                    pd.DataFrame(row_b["ms2_data"], columns=["mz", "intensity"]).to_numpy(),
-                    ms2_da=0.05
-                )
-                
-                # 计算中性损失相似度
-                nl_sim = spectral_entropy.all_similarity(
-                    pd.DataFrame(row_a["NL_data"], columns=["mz", "intensity"]).to_numpy(),
-                    pd.DataFrame(row_b["NL_data"], columns=["mz", "intensity"]).to_numpy(),
-                    ms2_da=0.005
-                )
-                
-                similarity_results.append({
-                    "Precursor_a": row_a["precursor"],
-                    "PeakID_a": row_a["PeakID"],
-                    "Precursor_b": row_b["precursor"],
-                    "PeakID_b": row_b["PeakID"],
-                    "Mass_difference": mass_difference,
-                    "MSforID distance version 1": ms2_sim.get("dot_product", 0),
-                    "MSforID distance version 1_NL": nl_sim.get("dot_product", 0)
-                })
+    # PMD 表按质量差排序建立索引，用于预筛选节点对和注释反应
+    pmd_index = PMDIndex(pmd_table['Mass Difference (Da)'], ms_threshold)
+    
+    # 计算相似度：分块并行比较所有节点对，质量差不满足条件的节点对不计算相似度；边按 (i, j) 顺序返回，无需再排序
+    pair_filter = pmd_index if pmd_prefilter else None
+    edges = list(iter_network_edges(
+        nodetable1["precursor"].to_numpy(dtype=np.float64),
+        nodetable1["ms2_data"],
+        nodetable1["NL_data"],
+        similarity_threshold,
+        n_seeds=n_seeds,
+        max_mass_difference=max_mass_difference,
+        pair_filter=pair_filter,
+        n_workers=n_workers,
+        spectrum_cache=spectrum_cache,
+        progress=progress
+    ))
     
     # 转换为 DataFrame
-    result_df = pd.DataFrame(similarity_results)
+    edges = np.array(edges, dtype=np.float64).reshape(-1, 5)
+    index_a, index_b = edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64)
+    result_df = pd.DataFrame({
+        "Precursor_a": nodetable1["precursor"].to_numpy()[index_a],
+        "PeakID_a": nodetable1["PeakID"].to_numpy()[index_a],
+        "Precursor_b": nodetable1["precursor"].to_numpy()[index_b],
+        "PeakID_b": nodetable1["PeakID"].to_numpy()[index_b],
+        "Mass_difference": edges[:, 2],
+        "MSforID distance version 1": edges[:, 3],
+        "MSforID distance version 1_NL": edges[:, 4]
+    })
+    
+    # 移除 PeakID 相同的配对
+    result_df = result_df[result_df['PeakID_a'] != result_df['PeakID_b']]
     
     # 应用相似度阈值过滤
     result_df = result_df[result_df['MSforID distance version 1'] > similarity_threshold]
     
-    # 添加反应和描述信息
-    result_df['Reaction'] = None
-    result_df['Description'] = None
-    
-    # 匹配 PMD 表中的信息
-    for idx, row in result_df.iterrows():
-        mass_diff = row['Mass_difference']
-        matches = pmd_table[
-            abs(pmd_table['Mass Difference (Da)'] - abs(mass_diff)) <= ms_threshold
-        ]
-        if not matches.empty:
-            result_df.at[idx, 'Reaction'] = matches.iloc[0]['Reaction']
-            result_df.at[idx, 'Description'] = matches.iloc[0]['Description']
+    # 添加反应和描述信息：一次匹配所有质量差，多个匹配时取 PMD 表中的第一行
+    progress("annotate", 0, len(result_df))
+    annotations = pmd_index.annotate(result_df['Mass_difference'], pmd_table)
+    progress("annotate", len(result_df), len(result_df))
+    result_df['Reaction'] = annotations['Reaction']
+    result_df['Description'] = annotations['Description']
     
     # 创建一个新列来确保一致的排序顺序
     def safe_sort(val):
@@ -167,8 +198,17 @@ def process_id_logic(peak_table, nodes_table, pmd_table, similarity_threshold, m
     
     return result_df
 
-def process_finder_logic(data, sn_threshold, area_threshold, mz_threshold, rt_threshold, best_rf_model):
-    """Finder_GUI 的核心处理逻辑"""
+def process_finder_logic(data, sn_threshold, area_threshold, mz_threshold, rt_threshold, best_rf_model,
+                         progress=None):
+    """Finder_GUI 的核心处理逻辑
+
+    progress: 进度回调 progress(stage, done, total)，None 表示不报告进度
+    """
+    if progress is None:
+        progress = _no_progress
+    
+    n_peaks = len(data)
+    progress("filter peaks", 0, n_peaks)
     # 创建数据的深拷贝，避免 SettingWithCopyWarning
     data = data.copy()
     
@@ -183,49 +223,31 @@ def process_finder_logic(data, sn_threshold, area_threshold, mz_threshold, rt_th
     mask = (data['Isotope'] == "M + 0") & (~data['Comment'].str.contains("found in higher mz's MsMs"))
     data = data[mask].copy()  # 使用 copy() 创建新的 DataFrame
     
-    # 处理加合物
+    progress("filter peaks", n_peaks, n_peaks)
+    
+    # 处理加合物，相互关联的加合物中只保留面积最大的峰
+    progress("resolve adducts", 0, len(data))
     data.loc[:, 'PeakID'] = data['PeakID'].astype(str)
-    indices_to_drop = []
-    
-    for index, row in data.iterrows():
-        if "adduct linked to" in row['Comment']:
-            comment_values = row['Comment'].split(';')
-            id_values = [
-                value.split("adduct linked to ")[1].split('_')[0].strip() 
-                for value in comment_values 
-                if "adduct linked to" in value
-            ]
-            
-            matching_rows = data[data['PeakID'].isin(id_values)]
-            if not matching_rows.empty:
-                combined_rows = pd.concat([row.to_frame().T, matching_rows])
-                max_area = combined_rows['Area'].max()
-                if row['Area'] < max_area:
-                    indices_to_drop.append(index)
-                    indices_to_drop.extend(
-                        matching_rows[matching_rows['Area'] < max_area].index
-                    )
-    
-    data = data.drop(indices_to_drop)
+    n_peaks = len(data)
+    data = data[resolve_adducts(data['PeakID'], data['Comment'], data['Area'])]
     data.reset_index(drop=True, inplace=True)
+    progress("resolve adducts", n_peaks, n_peaks)
     
     # 应用阈值过滤
     data = data.query('`S/N` >= @sn_threshold and `Area` >= @area_threshold')
     data = data.sort_values('Precursor m/z')
     
-    # 分组处理
-    groups = []
-    while not data.empty:
-        group_mask = (
-            (data['Precursor m/z'].sub(data.iloc[0]['Precursor m/z']).abs() <= mz_threshold) & 
-            (data['RT (min)'].sub(data.iloc[0]['RT (min)']).abs() <= rt_threshold)
-        )
-        group = data[group_mask]
-        largest_area_row = group.loc[group['Area'].idxmax()]
-        groups.append(largest_area_row)
-        data = data[~group_mask]
-    
-    peak_table = pd.DataFrame(groups)
+    # 分组处理，每组保留面积最大的峰
+    progress("group duplicates", 0, len(data))
+    kept = group_duplicate_peaks(
+        data['Precursor m/z'].to_numpy(),
+        data['RT (min)'].to_numpy(),
+        data['Area'].to_numpy(),
+        mz_threshold,
+        rt_threshold
+    )
+    peak_table = data.iloc[kept].copy()
+    progress("group duplicates", len(data), len(data))
     
     # 特征处理
     ms2int_threshold = 10.0
@@ -233,43 +255,26 @@ def process_finder_logic(data, sn_threshold, area_threshold, mz_threshold, rt_th
     mz_max = 400.0
     num_bins = 3500
     
-    # 初始化 m/z bins 矩阵
-    mz_bins_matrix = np.zeros((len(peak_table), num_bins))
-    
-    for i, row in enumerate(peak_table.itertuples()):
-        MS2_list = row.Spectra.split('\n')
-        mz = []
-        Relative_int = []
-        
-        for pair in MS2_list:
-            if pair:
-                try:
-                    mz_val, intensity_val = pair.split()
-                    mz.append(float(mz_val))
-                    Relative_int.append(float(intensity_val))
-                except ValueError:
-                    continue
-        
-        filtered_pairs = [
-            (mz_val, int_val) 
-            for mz_val, int_val in zip(mz, Relative_int) 
-            if int_val >= ms2int_threshold and mz_min <= mz_val <= mz_max
-        ]
-        
-        for mz_val, int_val in filtered_pairs:
-            bin_index = int((mz_val - mz_min) / (mz_max - mz_min) * num_bins)
-            bin_index = max(0, min(bin_index, num_bins - 1))
-            mz_bins_matrix[i, bin_index] += int_val
-    
-    # 准备模型输入数据
-    X = pd.DataFrame(
-        mz_bins_matrix,
-        columns=[f'bin_{i}' for i in range(num_bins)]
+    # 一次性解析所有 MS/MS 谱图并分箱（稀疏 float32 矩阵）
+    progress("featurize", 0, len(peak_table))
+    spectra = parse_msms_spectra(peak_table['MSMS spectrum'])
+    mz_bins_matrix = bin_spectra_sparse(
+        spectra.mz,
+        spectra.intensity,
+        spectra.row_index(),
+        spectra.n_spectra,
+        ms2int_threshold=ms2int_threshold,
+        mz_min=mz_min,
+        mz_max=mz_max,
+        num_bins=num_bins
     )
     
+    progress("featurize", len(peak_table), len(peak_table))
+    
     # 预测
-    y_pred = best_rf_model.predict(X)
-    y_proba = best_rf_model.predict_proba(X)[:, 1]
+    progress("predict", 0, len(peak_table))
+    y_pred, y_proba = predict_bins(best_rf_model, mz_bins_matrix)
+    progress("predict", len(peak_table), len(peak_table))
     
     # 添加预测结果
     peak_table['Predicted Label'] = y_pred
@@ -277,6 +282,235 @@ def process_finder_logic(data, sn_threshold, area_threshold, mz_threshold, rt_th
     
     return peak_table
 
+def run_id_logic(peak_table, data, progress=None):
+    """按请求参数对 Finder 的预测结果运行 ID 逻辑，返回结果表
+
+    data: 请求参数，JSON 或查询字符串（字符串值）
+    progress: 进度回调 progress(stage, done, total)，在任务队列中运行时用于报告进度和取消任务
+    """
+    # 从请求中获取参数
+    Add_nodes = int(data.get('add_nodes', 0))
+    similarity_threshold = float(data['similarity_threshold'])
+    ms_threshold = float(data['ms_threshold'])  # m/z tolerance (Da)
+    # 分子网络的可选参数
+    n_seeds = int(data['n_seeds']) if data.get('n_seeds') is not None else None
+    max_mass_difference = float(data['max_mass_difference']) if data.get('max_mass_difference') is not None else None
+    pmd_prefilter = str(data.get('pmd_prefilter', False)).lower() in ('1', 'true')
+    n_workers = int(data['n_workers']) if data.get('n_workers') is not None else None
+    
+    peak_table = peak_table[peak_table['Predicted Label'] == 1]
+    
+    if Add_nodes == 1:
+        Nodes_table = table_registry.get(NODES_TABLE_PATH)
+        peak_table = pd.concat([peak_table, Nodes_table], ignore_index=True)
+    
+    PMD_table = table_registry.get(PMD_TABLE_PATH)
+    
+    return process_id_logic(
+        peak_table,
+        Nodes_table if Add_nodes == 1 else None,
+        PMD_table,
+        similarity_threshold,
+        ms_threshold,
+        n_seeds=n_seeds,
+        max_mass_difference=max_mass_difference,
+        pmd_prefilter=pmd_prefilter,
+        n_workers=n_workers,
+        spectrum_cache=spectrum_cache,
+        progress=progress
+    )
+
+def run_id_request(data, progress=None):
+    """处理 /api/v1/id 请求：读取输入文件，运行 ID 逻辑并保存结果，返回响应内容
+
+    progress: 进度回调 progress(stage, done, total)，在任务队列中运行时用于报告进度和取消任务
+    """
+    if progress is None:
+        progress = _no_progress
+    
+    # 处理输出文件路径
+    output_file = './ID/result1.xlsx'  # 默认路径
+    if 'output_file' in data:
+        if isinstance(data['output_file'], str) and data['output_file'].strip():
+            output_file = data['output_file']
+            # 如果是目录而不是文件，则在目录中添加默认文件名
+            if output_file.endswith('\\') or output_file.endswith('/') or os.path.isdir(output_file):
+                if not output_file.endswith('\\') and not output_file.endswith('/'):
+                    output_file += '\\'
+                output_file += 'result1.xlsx'
+            print(f"Using custom output path: {output_file}")
+        else:
+            print(f"Warning: Invalid output_file value: {data['output_file']}")
+    
+    # 确保输出目录存在
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        print(f"Created output directory: {output_dir}")
+    
+    progress("read input")
+    peak_table = pd.read_csv(data['file_path'])
+    result_df = run_id_logic(peak_table, data, progress=progress)
+    
+    # 保存结果
+    progress("save result")
+    result_df.to_excel(output_file, index=False)
+    
+    # 限制返回的数据记录为前10条
+    data_records = result_df.head(10).to_dict(orient='records')
+    
+    return {
+        'status': 'success',
+        'message': 'ID processing completed successfully',
+        'output_file': output_file,
+        'row_count': len(result_df),
+        'data': data_records
+    }
+
+def run_finder_logic(input_data, data, progress=None):
+    """按请求参数加载模型（已加载时直接使用）并对 MS-DIAL 导出的表格运行 Finder 逻辑，返回结果表
+
+    data: 请求参数，JSON 或查询字符串（字符串值）
+    progress: 进度回调 progress(stage, done, total)，在任务队列中运行时用于报告进度和取消任务
+    """
+    print("loading model...")
+    # 加载模型
+    model_path = data.get('model_path', FINDER_MODEL_PATH)
+    best_rf_model = model_registry.get(model_path)
+    
+    # 执行处理逻辑
+    print("handle logic...")
+    return process_finder_logic(
+        input_data,
+        float(data['sn_threshold']),
+        float(data['area_threshold']),
+        float(data['mz_threshold']),
+        float(data['rt_threshold']),
+        best_rf_model,
+        progress=progress
+    )
+
+def run_finder_request(data, progress=None):
+    """处理 /api/v1/finder 请求：读取输入文件和模型，运行 Finder 逻辑并保存结果，返回响应内容
+
+    progress: 进度回调 progress(stage, done, total)，在任务队列中运行时用于报告进度和取消任务
+    """
+    if progress is None:
+        progress = _no_progress
+    
+    print("read model...")
+    # 读取输入文件
+    progress("read input")
+    input_data = pd.read_csv(data['file_path'], sep="\t")
+    result_df = run_finder_logic(input_data, data, progress=progress)
+    
+    # 保存结果
+    print("save result...")
+    
+    # 获取输出文件路径
+    output_file = './Finder/Predicted.csv'  # 默认路径
+    if 'output_file' in data:
+        if isinstance(data['output_file'], str) and data['output_file'].strip():
+            output_file = data['output_file']
+            # 如果是目录而不是文件，则在目录中添加默认文件名
+            if output_file.endswith('\\') or output_file.endswith('/') or os.path.isdir(output_file):
+                if not output_file.endswith('\\') and not output_file.endswith('/'):
+                    output_file += '\\'
+                output_file += 'Predicted.csv'
+            print(f"Using custom output path: {output_file}")
+        else:
+            print(f"Warning: Invalid output_file value: {data['output_file']}")
+    
+    # 确保输出目录存在
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        print(f"Created output directory: {output_dir}")
+    
+    print(f"to csv at path: {output_file}")
+    progress("save result")
+    result_df.to_csv(output_file, index=False)
+    
+    # 限制返回的数据记录为前10条
+    print("filter result...")
+    data_records = result_df.head(10).to_dict(orient='records')
+    
+    return {
+        'status': 'success',
+        'message': 'Finder processing completed successfully',
+        'output_file': output_file,
+        'row_count': len(result_df),
+        'data': data_records
+    }
+
+def run_finder_batch_request(data, progress=None):
+    """处理 /api/v1/finder/batch 请求：模型只加载一次，多个进程并行处理所有样本文件，
+    保存每个样本的 Predicted.csv 和合并后的结果表，返回每个文件的耗时
+
+    progress: 进度回调 progress(stage, done, total)，在任务队列中运行时用于报告进度和取消任务
+    """
+    if progress is None:
+        progress = _no_progress
+    start = time.perf_counter()
+    
+    # 展开文件列表和通配符，每个文件的结果保存在 <output_dir>/<样本名>/Predicted.csv
+    file_paths = expand_file_paths(data['file_paths'])
+    if not file_paths:
+        raise ValueError(f"No input file found: {data['file_paths']}")
+    samples = [sample_name(file_path) for file_path in file_paths]
+    duplicates = sorted({sample for sample in samples if samples.count(sample) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate sample names: {', '.join(duplicates)}")
+    output_dir = data.get('output_dir') or './Finder/batch'
+    output_files = [os.path.join(output_dir, sample, 'Predicted.csv') for sample in samples]
+    
+    # 加载模型，所有工作进程共用同一个已加载的模型
+    progress("load model")
+    model_path = data.get('model_path', FINDER_MODEL_PATH)
+    best_rf_model = model_registry.get(model_path)
+    finder_args = (
+        float(data['sn_threshold']),
+        float(data['area_threshold']),
+        float(data['mz_threshold']),
+        float(data['rt_threshold']),
+        best_rf_model
+    )
+    n_workers = int(data['n_workers']) if data.get('n_workers') is not None else None
+    
+    results = screen_files(list(zip(file_paths, output_files)), process_finder_logic, finder_args,
+                           n_workers=n_workers, progress=progress)
+    
+    # 合并所有样本的结果，添加样本名和来源文件列
+    progress("merge results")
+    merged = []
+    files = []
+    for sample, file_path, output_file, (result_df, info) in zip(samples, file_paths, output_files, results):
+        files.append({'sample': sample, 'file_path': file_path,
+                      'output_file': output_file if result_df is not None else None,
+                      'row_count': len(result_df) if result_df is not None else 0, **info})
+        if result_df is not None:
+            result_df.insert(0, 'Sample', sample)
+            result_df.insert(1, 'Source file', file_path)
+            merged.append(result_df)
+    merged_df = pd.concat(merged, ignore_index=True) if merged else pd.DataFrame(columns=['Sample', 'Source file'])
+    
+    os.makedirs(output_dir, exist_ok=True)
+    merged_file = os.path.join(output_dir, 'Predicted_merged.csv')
+    progress("save result")
+    merged_df.to_csv(merged_file, index=False)
+    
+    n_failed = sum(1 for file in files if 'error' in file)
+    return {
+        'status': 'success',
+        'message': f'Finder batch processing completed: {len(files) - n_failed} files succeeded, {n_failed} failed',
+        'output_dir': output_dir,
+        'merged_file': merged_file,
+        'row_count': len(merged_df),
+        'seconds': time.perf_counter() - start,
+        'files': files,
+        'data': merged_df.head(10).to_dict(orient='records')
+    }
+
 @app.route('/api/v1/id', methods=['POST'])
 def process_id():
     try:
@@ -288,234 +522,12 @@ def process_id():
             if param not in data:
                 return jsonify({'error': f'Missing required parameter: {param}'}), 400
         
-        # 从请求中获取参数
-        file_path = data['file_path']
-        Add_nodes = data.get('add_nodes', 0)
-        similarity_threshold = float(data['similarity_threshold'])
-        ms_threshold = float(data['ms_threshold'])  # m/z tolerance (Da)
-        
-        # 处理输出文件路径
-        output_file = './ID/result1.xlsx'  # 默认路径
-        if 'output_file' in data:
-            if isinstance(data['output_file'], str) and data['output_file'].strip():
-                output_file = data['output_file']
-                # 如果是目录而不是文件，则在目录中添加默认文件名
-                if output_file.endswith('\\') or output_file.endswith('/') or os.path.isdir(output_file):
-                    if not output_file.endswith('\\') and not output_file.endswith('/'):
-                        output_file += '\\'
-                    output_file += 'result1.xlsx'
-                print(f"Using custom output path: {output_file}")
-            else:
-                print(f"Warning: Invalid output_file value: {data['output_file']}")
-        
-        # 确保输出目录存在
-        output_dir = os.path.dirname(output_file)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-            print(f"Created output directory: {output_dir}")
-        
-        # 以下完全照抄 ID_GUI.py 的处理逻辑
-        peak_table = pd.read_csv(file_path)
-        peak_table = peak_table[peak_table['Predicted Label'] == 1]
-
-        if Add_nodes == 1:
-            Nodes_table_path = "./ID/Virtual_nodes.xlsx"
-            Nodes_table = pd.read_excel(Nodes_table_path)
-            peak_table = pd.concat([peak_table, Nodes_table], ignore_index=True)
-            
-        PMD_table_path = "./ID/PMD.xlsx"
-        PMD_table = pd.read_excel(PMD_table_path)
-
-        # Remove trailing ':' from the 'MSMS spectrum' column
-        peak_table['MSMS spectrum'] = peak_table['MSMS spectrum'].str.rstrip(':')
-
-        # Function to process the MS/MS spectrum and return a dictionary
-        def process_spectrum(spectrum):
-            if isinstance(spectrum, float):
-                return {}
-            return dict((float(mz.split(':')[0]), float(mz.split(':')[1])) for mz in spectrum.split(' '))
-
-        # Apply the function to create 'MSMS_dict'
-        peak_table['MSMS_dict'] = peak_table['MSMS spectrum'].apply(process_spectrum)
-
-        # Calculate neutral loss and store in 'NL_spectrum'
-        peak_table['NL_spectrum'] = peak_table.apply(lambda row: {round(row['Precursor m/z'] - mz, 5): intensity for mz, intensity in row['MSMS_dict'].items() if row['Precursor m/z'] - mz > 0}, axis=1)
-
-        # Convert the 'NL_spectrum' into a string format
-        peak_table['NL_spectrum_str'] = peak_table['NL_spectrum'].apply(lambda x: ' '.join([f'{mz}:{intensity}' for mz, intensity in x.items()]))
-
-        # Create a new DataFrame to store processed data
-        nodetable1 = pd.DataFrame(columns=["precursor", "RT", "PeakID", "ms2_data", "NL_data"])
-
-        # Iterate over the rows in the peak table
-        for index, row in peak_table.iterrows():
-            # If 'MSMS spectrum' is not empty
-            if not pd.isna(row["MSMS spectrum"]):
-                precursor = row["Precursor m/z"]
-                ms2_data = row["MSMS spectrum"]
-                PeakID = row["PeakID"]
-                
-                # Convert MS/MS spectrum data to DataFrame
-                ms2_df = pd.DataFrame([entry.split(':') for entry in ms2_data.split(" ")], columns=["mz", "intensity"])
-                ms2_df["mz"] = ms2_df["mz"].astype(float)
-                ms2_df["intensity"] = ms2_df["intensity"].astype(float)
-                
-                # Clean the spectrum using spectral_entropy library
-                clean_spectrum = spectral_entropy.clean_spectrum(ms2_df.to_numpy(), max_mz=800, noise_removal=0.01, ms2_da=0.01)
-                RT = row["RT (min)"]
-                
-                # Process neutral loss spectrum
-                NL_data = row["NL_spectrum_str"]
-                NL_df = pd.DataFrame([entry.split(':') for entry in NL_data.split()], columns=["mz", "intensity"])
-                NL_df["mz"] = NL_df["mz"].astype(float)
-                NL_df["intensity"] = NL_df["intensity"].astype(float)
-                
-                clean_NL_spectrum = spectral_entropy.clean_spectrum(NL_df.to_numpy(), max_mz=precursor, noise_removal=0.01, ms2_da=0.01)
-                
-                # Append to nodetable1 DataFrame
-                new_row = pd.DataFrame([{
-                    "precursor": precursor, 
-                    "RT": RT, 
-                    "PeakID": PeakID,
-                    "ms2_data": clean_spectrum, 
-                    "NL_data": clean_NL_spectrum
-                }])
-                nodetable1 = pd.concat([nodetable1, new_row], ignore_index=True)
-            
-            # If 'MSMS spectrum' is empty
-            if pd.isna(row["MSMS spectrum"]):
-                precursor = row["Precursor m/z"]
-                RT = row["RT (min)"]
-                PeakID = row["PeakID"]
-                nodetable1 = nodetable1.append({"precursor": precursor, "RT": RT, "PeakID": PeakID}, ignore_index=True)
-
-        # Remove rows with missing 'ms2_data'
-        nodetable1 = nodetable1.dropna(subset=['ms2_data'])
-
-        # Create an empty DataFrame to store similarity scores
-        similarity_df = pd.DataFrame(columns=["Precursor_a", "PeakID_a", "Precursor_b", "PeakID_b", "Mass_difference"])
-        similarity_df1 = []
-        similarity_df2 = []
-
-        # Iterate through all possible combinations to calculate similarity
-        max_index = max(nodetable1.index)
-
-        # Only loop through the first two rows with other rows
-        for index_a, row_a in nodetable1.iterrows():
-            if index_a >= 2:  # Only process the first two rows
-                break
-
-            for index_b in range(index_a + 1, max_index + 1):
-                if index_b in nodetable1.index:
-                    row_b = nodetable1.loc[index_b]
-                    Precursor_a = row_a["precursor"]
-                    Precursor_b = row_b["precursor"]
-                    Mass_difference = Precursor_b - Precursor_a
-                    PeakID_a = row_a["PeakID"]
-                    ms2_data_a = row_a["ms2_data"]
-                    NL_data_a = row_a["NL_data"]
-                    PeakID_b = row_b["PeakID"]
-                    ms2_data_b = row_b["ms2_data"]
-                    NL_data_b = row_b["NL_data"]
-
-                    # Convert MS2 data to DataFrame
-                    ms2_df_a = pd.DataFrame(ms2_data_a, columns=["mz", "intensity"])
-                    NL_df_a = pd.DataFrame(NL_data_a, columns=["mz", "intensity"])
-                    ms2_df_b = pd.DataFrame(ms2_data_b, columns=["mz", "intensity"])
-                    NL_df_b = pd.DataFrame(NL_data_b, columns=["mz", "intensity"])
-
-                    # Ensure data types are float
-                    for df in [ms2_df_a, NL_df_a, ms2_df_b, NL_df_b]:
-                        df["mz"] = df["mz"].astype(float)
-                        df["intensity"] = df["intensity"].astype(float)
-
-                    # Calculate similarity
-                    all_dist = spectral_entropy.all_similarity(ms2_df_a.to_numpy(), ms2_df_b.to_numpy(), ms2_da=0.05)
-                    similarity_values1 = {spectral_entropy.methods_name[dist_name]: value for dist_name, value in all_dist.items()}
-                    similarity_df1.append(similarity_values1)
-
-                    all_dist = spectral_entropy.all_similarity(NL_df_a.to_numpy(), NL_df_b.to_numpy(), ms2_da=0.005)
-                    similarity_values2 = {spectral_entropy.methods_name[dist_name] + "_NL": value for dist_name, value in all_dist.items()}
-                    similarity_df2.append(similarity_values2)
-
-                    # Assuming similarity_df is a DataFrame and similarity_values contains the data
-                    similarity_row = pd.DataFrame([{
-                        "Precursor_a": Precursor_a,
-                        "PeakID_a": PeakID_a,
-                        "Precursor_b": Precursor_b,
-                        "PeakID_b": PeakID_b,
-                        "Mass_difference": Mass_difference
-                    }])
-                    similarity_df = pd.concat([similarity_df, similarity_row], ignore_index=True)
-
-        # Convert similarity score lists to DataFrames
-        similarity_df1 = pd.DataFrame(similarity_df1)
-        similarity_df2 = pd.DataFrame(similarity_df2)
-
-        # Merge results
-        result_df = pd.concat([similarity_df, similarity_df1, similarity_df2], axis=1)
-
-        # Remove rows where PeakID_a and PeakID_b are equal
-        result_df = result_df[result_df['PeakID_a'] != result_df['PeakID_b']]
-
-        # Keep the first 5 columns
-        columns_to_keep = result_df.columns[:5].tolist()
-
-        # Check for additional columns and add them to the list
-        additional_columns = ['MSforID distance version 1', 'MSforID distance version 1_NL']
-        for col in additional_columns:
-            if col in result_df.columns:
-                columns_to_keep.append(col)
-            else:
-                raise KeyError(f"Column {col} not found in the DataFrame.")
-
-        # Retain only the required columns
-        result_df = result_df[columns_to_keep]
-        result_df = result_df[result_df['MSforID distance version 1'] > similarity_threshold]
-
-        # Add 'Reaction' and 'Description' columns to result_df
-        result_df['Reaction'] = None
-        result_df['Description'] = None
-
-        # Iterate through each row of result_df
-        for idx, row in result_df.iterrows():
-            mass_diff = row['Mass_difference']
-            matches = PMD_table[abs(PMD_table['Mass Difference (Da)'] - abs(mass_diff)) <= ms_threshold]
-            if not matches.empty:
-                result_df.at[idx, 'Reaction'] = matches.iloc[0]['Reaction']
-                result_df.at[idx, 'Description'] = matches.iloc[0]['Description']
-
-        # Create a new column to ensure consistent order of inchikey1 and inchikey2
-        def safe_sort(val):
-            if isinstance(val, str):
-                return float('inf')  
-            return val  
-
-        result_df['sorted_inchikeys'] = result_df.apply(
-            lambda row: tuple(sorted([row['PeakID_a'], row['PeakID_b']], key=safe_sort)), axis=1
-        )
-
-        # Retain the rows with the maximum similarity for the same sorted_inchikeys
-        result_df_max_similarity = result_df.loc[
-            result_df.groupby(['sorted_inchikeys'])['MSforID distance version 1'].idxmax()
-        ].reset_index(drop=True)
-
-        # Drop the temporary column
-        result_df = result_df_max_similarity.drop(columns=['sorted_inchikeys'])
-        
-        # 保存结果
-        result_df.to_excel(output_file, index=False)
-        
-        # 限制返回的数据记录为前10条
-        data_records = result_df.head(10).to_dict(orient='records')
+        # async 为 true 时放入任务队列，立即返回任务 ID，通过 /api/v1/jobs/<job_id> 查询状态和结果
+        if data.get('async'):
+            job = job_queue.submit('id', run_id_request, data)
+            return jsonify({'status': 'queued', 'message': 'ID job queued', 'job_id': job.id}), 202
         
-        return jsonify({
-            'status': 'success',
-            'message': 'ID processing completed successfully',
-            'output_file': output_file,
-            'row_count': len(result_df),
-            'data': data_records
-        })
+        return jsonify(run_id_request(data))
         
     except Exception as e:
         print(f"Error in process_id: {str(e)}")
@@ -546,68 +558,183 @@ def process_finder():
             if param not in data:
                 return jsonify({'error': f'Missing required parameter: {param}'}), 400
         
-        print("read model...")
-        # 读取输入文件
-        input_data = pd.read_csv(data['file_path'], sep="\t")
+        # async 为 true 时放入任务队列，立即返回任务 ID，通过 /api/v1/jobs/<job_id> 查询状态和结果
+        if data.get('async'):
+            job = job_queue.submit('finder', run_finder_request, data)
+            return jsonify({'status': 'queued', 'message': 'Finder job queued', 'job_id': job.id}), 202
         
-        print("loading model...")
-        # 加载模型
-        model_path = data.get('model_path', './Finder/Fentanyl_Finder.pkl')
-        best_rf_model = joblib.load(model_path)
+        return jsonify(run_finder_request(data))
         
-        # 执行处理逻辑
-        print("handle logic...")
-        result_df = process_finder_logic(
-            input_data,
-            float(data['sn_threshold']),
-            float(data['area_threshold']),
-            float(data['mz_threshold']),
-            float(data['rt_threshold']),
-            best_rf_model
-        )
+    except Exception as e:
+        print(f"Error in process_finder: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def _output_format():
+    # 结果格式：优先使用查询参数 format，否则根据 Accept 头选择，默认 CSV
+    output_format = request.args.get('format')
+    if output_format is None:
+        output_format = 'arrow' if table_io.ARROW_MIMETYPE in request.headers.get('Accept', '') else 'csv'
+    return output_format
+
+def _stream_table(df, output_format, file_name):
+    # 分块生成 CSV 或 Arrow 流返回结果表，不写入本地文件
+    if output_format == 'arrow':
+        chunks, mimetype, extension = table_io.iter_arrow(df), table_io.ARROW_MIMETYPE, 'arrows'
+    else:
+        chunks, mimetype, extension = table_io.iter_csv(df), table_io.CSV_MIMETYPE, 'csv'
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={file_name}.{extension}',
+        'X-Row-Count': str(len(df))
+    })
+
+def _upload_request(required_params, sep, run_logic, file_name):
+    # 请求体为输入表格（可用 gzip/zstd 压缩并设置 Content-Encoding），参数在查询字符串中
+    # 边解压边解析请求体，不在内存中保留整个请求体（解析后的表格仍完整载入内存），不读写本地文件，适合远程客户端
+    data = request.args.to_dict()
+    for param in required_params:
+        if param not in data:
+            return jsonify({'error': f'Missing required parameter: {param}'}), 400
+    
+    output_format = _output_format()
+    if output_format not in table_io.output_formats():
+        return jsonify({'error': f'Unsupported format: {output_format}, '
+                                 f'supported: {", ".join(table_io.output_formats())}'}), 406
+    
+    try:
+        input_data = table_io.read_table(request.stream, request.headers.get('Content-Encoding'), sep=sep)
+    except table_io.UnsupportedEncoding as e:
+        return jsonify({'error': str(e)}), 415
+    
+    result_df = run_logic(input_data, data)
+    return _stream_table(result_df, output_format, file_name)
+
+@app.route('/api/v1/finder/upload', methods=['POST'])
+def upload_finder():
+    try:
+        return _upload_request(['sn_threshold', 'area_threshold', 'mz_threshold', 'rt_threshold'],
+                               '\t', run_finder_logic, 'Predicted')
+    except Exception as e:
+        print(f"Error in upload_finder: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/v1/id/upload', methods=['POST'])
+def upload_id():
+    try:
+        return _upload_request(['similarity_threshold', 'ms_threshold'], ',', run_id_logic, 'result')
+    except Exception as e:
+        print(f"Error in upload_id: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/v1/finder/batch', methods=['POST'])
+def process_finder_batch():
+    try:
+        data = request.get_json()
         
-        # 保存结果
-        print("save result...")
+        # 参数验证
+        required_params = ['file_paths', 'sn_threshold', 'area_threshold', 'mz_threshold', 'rt_threshold']
+        for param in required_params:
+            if param not in data:
+                return jsonify({'error': f'Missing required parameter: {param}'}), 400
         
-        # 获取输出文件路径
-        output_file = './Finder/Predicted.csv'  # 默认路径
-        if 'output_file' in data:
-            if isinstance(data['output_file'], str) and data['output_file'].strip():
-                output_file = data['output_file']
-                # 如果是目录而不是文件，则在目录中添加默认文件名
-                if output_file.endswith('\\') or output_file.endswith('/') or os.path.isdir(output_file):
-                    if not output_file.endswith('\\') and not output_file.endswith('/'):
-                        output_file += '\\'
-                    output_file += 'Predicted.csv'
-                print(f"Using custom output path: {output_file}")
-            else:
-                print(f"Warning: Invalid output_file value: {data['output_file']}")
+        # async 为 true 时放入任务队列，立即返回任务 ID，通过 /api/v1/jobs/<job_id> 查询状态和结果
+        if data.get('async'):
+            job = job_queue.submit('finder_batch', run_finder_batch_request, data)
+            return jsonify({'status': 'queued', 'message': 'Finder batch job queued', 'job_id': job.id}), 202
         
-        # 确保输出目录存在
-        output_dir = os.path.dirname(output_file)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-            print(f"Created output directory: {output_dir}")
+        return jsonify(run_finder_batch_request(data))
         
-        print(f"to csv at path: {output_file}")
-        result_df.to_csv(output_file, index=False)
+    except Exception as e:
+        print(f"Error in process_finder_batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/v1/models/reload', methods=['POST'])
+def reload_models():
+    try:
+        data = request.get_json(silent=True) or {}
         
-        # 限制返回的数据记录为前10条
-        print("filter result...")
-        data_records = result_df.head(10).to_dict(orient='records')
+        # 不指定 model_path 时重新加载所有已缓存的模型
+        reloaded = model_registry.reload(data.get('model_path'))
         
         return jsonify({
             'status': 'success',
-            'message': 'Finder processing completed successfully',
-            'output_file': output_file,
-            'row_count': len(result_df),
-            'data': data_records
+            'message': 'Models reloaded successfully',
+            'models': reloaded
         })
         
+    except FileNotFoundError as e:
+        return jsonify({'error': f'Model file not found: {e.filename}'}), 404
     except Exception as e:
-        print(f"Error in process_finder: {str(e)}")
+        print(f"Error in reload_models: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': [job.to_dict(with_result=False) for job in job_queue.jobs()]})
+
+@app.route('/api/v1/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/v1/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    # 以 Server-Sent Events 推送任务的状态和进度事件（阶段、已完成/总数、耗时、吞吐量），任务结束后关闭连接
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    
+    def stream():
+        sent = 0
+        while True:
+            events = job.wait_events(sent, timeout=15)
+            if not events:
+                # 保持连接，避免代理或客户端超时断开
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            sent += len(events)
+            if events[-1]['event'] == 'state' and events[-1]['state'] in FINISHED_STATES:
+                return
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/v1/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    # 排队中的任务不再运行，运行中的任务在下一次报告进度时停止
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify(job.to_dict(with_result=False))
+
+@app.route('/api/v1/health', methods=['GET'])
+def health():
+    # 存活检查：进程能处理请求即返回 200
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/api/v1/ready', methods=['GET'])
+def ready():
+    # 就绪检查：加载默认的模型和表（已加载时不重新加载），都已加载时返回 200，否则返回 503
+    try:
+        loaded = preload(verbose=False)
+        error = None
+    except Exception as e:
+        loaded = {name: os.path.abspath(path) in registry.loaded() for name, registry, path in _preloaded_files()}
+        error = f"{type(e).__name__}: {e}"
+    is_ready = error is None and all(loaded.values())
+    info = {
+        'status': 'ready' if is_ready else 'not ready',
+        'loaded': loaded,
+        'spectral_entropy_backend': spectral_entropy.get_backend(),
+        'pid': os.getpid()
+    }
+    if error is not None:
+        info['error'] = error
+    return jsonify(info), 200 if is_ready else 503
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
@@ -618,5 +745,9 @@ def method_not_allowed(error):
 
         
 if __name__ == '__main__':
-
-    app.run(host='0.0.0.0', port=5000,debug=True)
+    # 打包 (PyInstaller) 后在 Windows 上启动 ID 和批量 Finder 的进程池时需要
+    multiprocessing.freeze_support()
+    # 开发服务器，生产环境使用 wsgi.py（见 gunicorn.conf.py）；FLASK_DEBUG=1 时启用调试模式
+    print(f"spectral_entropy backend: {spectral_entropy.get_backend()}")
+    preload()
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=os.environ.get('FLASK_DEBUG') == '1')
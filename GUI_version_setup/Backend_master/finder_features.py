@@ -0,0 +1,92 @@
+import warnings
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def _bin_peaks(mz, intensity, row_index, ms2int_threshold, mz_min, mz_max, num_bins):
+    """Filter the peaks and return the (row, bin, intensity) of the peaks kept."""
+    mz = np.asarray(mz, dtype=np.float64)
+    intensity = np.asarray(intensity, dtype=np.float64)
+    row_index = np.asarray(row_index, dtype=np.int64)
+
+    keep = (intensity >= ms2int_threshold) & (mz >= mz_min) & (mz <= mz_max)
+    mz, intensity, row_index = mz[keep], intensity[keep], row_index[keep]
+
+    bin_index = ((mz - mz_min) / (mz_max - mz_min) * num_bins).astype(np.int64)
+    np.clip(bin_index, 0, num_bins - 1, out=bin_index)
+    return row_index, bin_index, intensity
+
+
+def bin_spectra(mz, intensity, row_index, n_rows: int,
+                ms2int_threshold: float = 10.0, mz_min: float = 50.0, mz_max: float = 400.0,
+                num_bins: int = 3500) -> np.ndarray:
+    """
+    Build the m/z bins matrix used by Fentanyl Finder from flat peak arrays.
+
+    Peaks with intensity lower than ms2int_threshold or m/z outside [mz_min, mz_max] are removed, the rest are summed
+    into num_bins equal-width bins between mz_min and mz_max.
+
+    :param mz: The m/z of all peaks.
+    :param intensity: The intensity of all peaks.
+    :param row_index: The row (spectrum) each peak belongs to.
+    :param n_rows: The number of rows (spectra).
+    :return: A (n_rows, num_bins) float64 matrix.
+    """
+    row_index, bin_index, intensity = _bin_peaks(mz, intensity, row_index,
+                                                 ms2int_threshold, mz_min, mz_max, num_bins)
+    mz_bins_matrix = np.bincount(row_index * num_bins + bin_index, weights=intensity,
+                                 minlength=n_rows * num_bins)
+    return mz_bins_matrix.reshape(n_rows, num_bins)
+
+
+def bin_spectra_sparse(mz, intensity, row_index, n_rows: int,
+                       ms2int_threshold: float = 10.0, mz_min: float = 50.0, mz_max: float = 400.0,
+                       num_bins: int = 3500) -> csr_matrix:
+    """
+    Same as bin_spectra, but return a float32 CSR matrix which only stores the non-empty bins.
+
+    The bins are summed in float64 before the conversion to float32, which is the precision used by the tree models.
+    """
+    row_index, bin_index, intensity = _bin_peaks(mz, intensity, row_index,
+                                                 ms2int_threshold, mz_min, mz_max, num_bins)
+    # Duplicated (row, bin) entries are summed when converting to CSR.
+    mz_bins_matrix = csr_matrix((intensity, (row_index, bin_index)), shape=(n_rows, num_bins), dtype=np.float64)
+    mz_bins_matrix.sum_duplicates()
+    return mz_bins_matrix.astype(np.float32)
+
+
+def check_feature_names(model, num_bins: int = 3500):
+    """
+    Check the model was trained on the bin_0 ... bin_{num_bins - 1} columns, in this order.
+
+    Models trained without feature names are accepted as they are.
+    """
+    feature_names = getattr(model, "feature_names_in_", None)
+    if feature_names is None:
+        return
+    expected = [f"bin_{i}" for i in range(num_bins)]
+    if list(feature_names) != expected:
+        raise ValueError("The model is not trained on the {} m/z bins features!".format(num_bins))
+
+
+def predict_bins(model, mz_bins_matrix):
+    """
+    Predict the label and the probability of the positive class from the m/z bins matrix.
+
+    The matrix can be dense or sparse. The feature names are checked once by check_feature_names, so the matrix is
+    passed to the model without building a DataFrame.
+
+    :return: (y_pred, y_proba)
+    """
+    check_feature_names(model, mz_bins_matrix.shape[1])
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        proba = model.predict_proba(mz_bins_matrix)
+        classes = getattr(model, "classes_", None)
+        if classes is not None:
+            # Same as model.predict, without running the forest a second time.
+            y_pred = classes.take(np.argmax(proba, axis=1))
+        else:
+            y_pred = model.predict(mz_bins_matrix)
+    return y_pred, proba[:, 1]
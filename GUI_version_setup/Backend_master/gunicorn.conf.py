@@ -0,0 +1,28 @@
+"""
+Configuration of gunicorn, the production server of the backend on Linux and macOS:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Set with environment variables:
+    BIND: The address the server listens on, default 0.0.0.0:5000.
+    WEB_WORKERS: The number of worker processes, default 2.
+    WEB_THREADS: The number of threads of each worker, default 4.
+    JOB_STATE_DIR: The directory where the background jobs are shared by the workers, default in the temp directory.
+"""
+import os
+import tempfile
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_WORKERS", 2))
+
+# With threads, the clients following a job (polling or server-sent events) do not block a whole worker.
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))
+
+# Load the app, the Finder model and the tables of ID once, before forking the workers (see wsgi.py).
+preload_app = True
+
+# A job started by one worker can be polled or cancelled through any other one.
+if workers > 1:
+    os.environ.setdefault("JOB_STATE_DIR", os.path.join(tempfile.gettempdir(), "fentanyl_hunter_jobs"))
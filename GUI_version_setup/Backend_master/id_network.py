@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+import spectral_entropy
+from spectral_entropy.parallel import split_blocks, state_pool, worker_state
+
+# The similarity method used for the MS2 and the neutral loss spectra, and the tolerance of each.
+SIMILARITY_METHOD = "ms_for_id_v1"
+MS2_DA = 0.05
+NL_DA = 0.005
+
+# The number of processes used when n_workers is not given: the ID_WORKERS environment variable, or the number of CPUs
+# but at most MAX_DEFAULT_WORKERS, since several ID jobs may run at once.
+MAX_DEFAULT_WORKERS = 4
+
+
+def _make_state(precursor, ms2_spectra, nl_spectra, similarity_threshold, max_mass_difference, pair_filter):
+    return dict(precursor=precursor, ms2_spectra=ms2_spectra, nl_spectra=nl_spectra,
+                similarity_threshold=similarity_threshold, max_mass_difference=max_mass_difference,
+                pair_filter=pair_filter)
+
+
+def _candidate_pairs(state, i):
+    """The nodes after node i which pass the mass difference filters, and their mass difference."""
+    precursor = state["precursor"]
+    j = np.arange(i + 1, precursor.shape[0])
+    mass_difference = precursor[j] - precursor[i]
+    keep = np.ones(j.shape[0], dtype=bool)
+    if state["max_mass_difference"] is not None:
+        keep &= np.abs(mass_difference) <= state["max_mass_difference"]
+    if state["pair_filter"] is not None and keep.any():
+        keep[keep] = state["pair_filter"](mass_difference[keep])
+    return j[keep], mass_difference[keep]
+
+
+def _score_block(state, i_start, i_end):
+    """Score all candidate pairs (i, j), i_start <= i < i_end, j > i, and return the edges above the threshold."""
+    ms2_spectra, nl_spectra = state["ms2_spectra"], state["nl_spectra"]
+    edges = []
+    for i in range(i_start, i_end):
+        j_list, mass_difference_list = _candidate_pairs(state, i)
+        for j, mass_difference in zip(j_list, mass_difference_list):
+            ms2_sim = spectral_entropy.multiple_similarity(ms2_spectra[i], ms2_spectra[j],
+                                                           methods=[SIMILARITY_METHOD], ms2_da=MS2_DA,
+                                                           need_clean_spectra=False)
+            ms2_sim = ms2_sim[SIMILARITY_METHOD]
+            if ms2_sim <= state["similarity_threshold"]:
+                continue
+            nl_sim = spectral_entropy.multiple_similarity(nl_spectra[i], nl_spectra[j],
+                                                          methods=[SIMILARITY_METHOD], ms2_da=NL_DA,
+                                                          need_clean_spectra=False)
+            edges.append((i, int(j), float(mass_difference), ms2_sim, nl_sim[SIMILARITY_METHOD]))
+    return edges
+
+
+def _score_block_in_worker(i_start, i_end):
+    return _score_block(worker_state, i_start, i_end)
+
+
+def _n_pairs(n_nodes, i_start, i_end):
+    """The number of pairs (i, j), i_start <= i < i_end, j > i."""
+    return sum(n_nodes - 1 - i for i in range(i_start, i_end))
+
+
+def default_workers() -> int:
+    """The number of processes scoring the pairs when n_workers is not given."""
+    if os.environ.get("ID_WORKERS"):
+        return max(1, int(os.environ["ID_WORKERS"]))
+    return min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS)
+
+
+def _no_progress(stage, done=None, total=None):
+    pass
+
+
+def _clean_for_similarity(spectra, ms2_da, spectrum_cache):
+    """Clean each spectrum once, as multiple_similarity would clean it again for every pair."""
+    clean_spectrum = spectral_entropy.clean_spectrum if spectrum_cache is None else spectrum_cache.clean_spectrum
+    return [clean_spectrum(spectrum, ms2_da=ms2_da) for spectrum in spectra]
+
+
+def iter_network_edges(precursor, ms2_spectra, nl_spectra, similarity_threshold: float,
+                       n_seeds: int = None, max_mass_difference: float = None, pair_filter=None,
+                       n_workers: int = None, block_size: int = 20000, spectrum_cache=None, progress=None):
+    """
+    Compare the nodes pairwise and yield the edges of the molecular network, sorted by (i, j).
+
+    Pair (i, j), i < j, is compared when i is one of the first n_seeds nodes. Pairs whose precursor mass difference is
+    larger than max_mass_difference, or rejected by pair_filter, are skipped before any spectrum is compared.
+    The pairs are scored in blocks, in parallel over n_workers processes when there is more than one block. The edges
+    of each block are yielded as soon as it and the blocks before it are scored, so that they are never all held in
+    memory at once.
+
+    :param precursor: Precursor m/z of the nodes.
+    :param ms2_spectra: The cleaned MS2 spectrum of each node.
+    :param nl_spectra: The cleaned neutral loss spectrum of each node.
+    :param similarity_threshold: Only pairs with MS2 similarity higher than this value are kept.
+    :param n_seeds: Only compare the first n_seeds nodes with the others, None to compare all pairs.
+    :param max_mass_difference: The largest precursor mass difference (Da) to compare, None for no limit.
+    :param pair_filter: A function taking an array of mass differences and returning a boolean mask of pairs to compare,
+                        e.g. a pmd_index.PMDIndex.
+    :param n_workers: The number of processes, None for default_workers(). Never more than the number of blocks.
+    :param block_size: The number of pairs in each block.
+    :param spectrum_cache: A spectral_entropy.SpectrumCache to reuse the spectra cleaned for the similarity, None to
+                           clean them again.
+    :param progress: A function called as progress("similarity", pairs done, total pairs) after each block, counting
+                     the pairs before the mass difference filters.
+    :return: A generator of (i, j, mass difference, MS2 similarity, neutral loss similarity) tuples.
+    """
+    precursor = np.asarray(precursor, dtype=np.float64)
+    n_nodes = precursor.shape[0]
+    n_seeds = n_nodes if n_seeds is None else min(n_seeds, n_nodes)
+    blocks = split_blocks((n_nodes - 1 - i for i in range(n_seeds)), block_size)
+    state = _make_state(precursor, _clean_for_similarity(ms2_spectra, MS2_DA, spectrum_cache),
+                        _clean_for_similarity(nl_spectra, NL_DA, spectrum_cache), similarity_threshold,
+                        max_mass_difference, pair_filter)
+
+    if progress is None:
+        progress = _no_progress
+    n_pairs = {block: _n_pairs(n_nodes, *block) for block in blocks}
+    total_pairs, pairs_done = sum(n_pairs.values()), 0
+    progress("similarity", pairs_done, total_pairs)
+
+    if n_workers is None:
+        n_workers = default_workers()
+    n_workers = min(n_workers, len(blocks))
+
+    if n_workers <= 1:
+        for block in blocks:
+            for edge in _score_block(state, *block):
+                yield edge
+            pairs_done += n_pairs[block]
+            progress("similarity", pairs_done, total_pairs)
+        return
+
+    with state_pool(n_workers, state) as executor:
+        futures = [executor.submit(_score_block_in_worker, *block) for block in blocks]
+        try:
+            # In the order of the blocks, the blocks scored ahead of their turn wait for the ones before them.
+            for block, future in zip(blocks, futures):
+                for edge in future.result():
+                    yield edge
+                pairs_done += n_pairs[block]
+                progress("similarity", pairs_done, total_pairs)
+        except BaseException:
+            # Do not wait for the blocks not started yet, e.g. when progress() stops a cancelled job.
+            for future in futures:
+                future.cancel()
+            raise
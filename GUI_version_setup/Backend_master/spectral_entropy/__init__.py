@@ -3,4 +3,8 @@ from spectral_entropy.spectral_similarity import \
     similarity, all_similarity, multiple_similarity, \
     distance, all_distance, multiple_distance
 from spectral_entropy.spectral_entropy import calculate_entropy, calculate_entropy_similarity
-from spectral_entropy.tools import clean_spectrum
+from spectral_entropy.tools import clean_spectrum, clean_spectra_batch, get_backend
+from spectral_entropy.library import SpectralLibrary, read_msp
+from spectral_entropy.flash_entropy import FlashEntropyIndex
+from spectral_entropy.matrix import similarity_matrix
+from spectral_entropy.spectrum_cache import SpectrumCache
@@ -0,0 +1,247 @@
+"""
+Evaluate many distance methods on the same matched peaks at once.
+
+The math_distance functions each compute again the differences, sums, powers and entropies of the matched
+intensities. Here every intermediate result is computed once, with the same numpy operations as in math_distance,
+so the distances are identical to the ones of the single method functions.
+"""
+import numpy as np
+import scipy.special
+from functools import cached_property
+
+from . import math_distance, ms_distance
+
+
+class MatchedPeaks:
+    """The intermediate results shared by the distance methods, for the matched intensities p and q."""
+
+    def __init__(self, p, q):
+        self.p = p
+        self.q = q
+
+    @cached_property
+    def diff(self):
+        return self.p - self.q
+
+    @cached_property
+    def abs_diff(self):
+        return np.abs(self.diff)
+
+    @cached_property
+    def squared_diff(self):
+        return np.power(self.diff, 2)
+
+    @cached_property
+    def sum_abs_diff(self):
+        return np.sum(self.abs_diff)
+
+    @cached_property
+    def max_abs_diff(self):
+        return np.max(self.abs_diff)
+
+    @cached_property
+    def sum_squared_diff(self):
+        return np.sum(self.squared_diff)
+
+    @cached_property
+    def merged(self):
+        return self.p + self.q
+
+    @cached_property
+    def sum_merged(self):
+        return np.sum(self.merged)
+
+    @cached_property
+    def abs_merged(self):
+        return np.abs(self.p) + np.abs(self.q)
+
+    @cached_property
+    def product(self):
+        return self.p * self.q
+
+    @cached_property
+    def sum_product(self):
+        return np.sum(self.product)
+
+    @cached_property
+    def sum_sqrt_product(self):
+        return np.sum(np.sqrt(self.product))
+
+    @cached_property
+    def sum_squared_sqrt_diff(self):
+        return np.sum(np.power(np.sqrt(self.p) - np.sqrt(self.q), 2))
+
+    @cached_property
+    def minimum(self):
+        return np.minimum(self.p, self.q)
+
+    @cached_property
+    def maximum(self):
+        return np.maximum(self.p, self.q)
+
+    @cached_property
+    def sum_minimum(self):
+        return np.sum(self.minimum)
+
+    @cached_property
+    def sum_maximum(self):
+        return np.sum(self.maximum)
+
+    @cached_property
+    def sum_p(self):
+        return np.sum(self.p)
+
+    @cached_property
+    def sum_q(self):
+        return np.sum(self.q)
+
+    @cached_property
+    def sum_squared_p(self):
+        return np.sum(np.power(self.p, 2))
+
+    @cached_property
+    def sum_squared_q(self):
+        return np.sum(np.power(self.q, 2))
+
+    @cached_property
+    def n(self):
+        return np.sum(self.p > 0)
+
+    @cached_property
+    def p_avg(self):
+        return np.mean(self.p)
+
+    @cached_property
+    def q_avg(self):
+        return np.mean(self.q)
+
+    @cached_property
+    def p_centered(self):
+        return self.p - self.p_avg
+
+    @cached_property
+    def q_centered(self):
+        return self.q - self.q_avg
+
+    @cached_property
+    def p_relative(self):
+        return self.p / self.p_avg
+
+    @cached_property
+    def q_relative(self):
+        return self.q / self.q_avg
+
+    @cached_property
+    def entropy_p(self):
+        return _entropy(self.p)
+
+    @cached_property
+    def entropy_q(self):
+        return _entropy(self.q)
+
+    @cached_property
+    def entropy_merged(self):
+        return _entropy(self.merged)
+
+
+def _entropy(x):
+    """
+    The same computation as scipy.stats.entropy(x) for a 1-D x, without its argument checking which takes most of
+    the time for the short arrays of matched peaks.
+    """
+    x = 1.0 * x / np.sum(x, keepdims=True)
+    return np.sum(scipy.special.entr(x))
+
+
+def _entropy_distance(s):
+    p = math_distance._weight_intensity_by_entropy(s.p, s.entropy_p)
+    q = math_distance._weight_intensity_by_entropy(s.q, s.entropy_q)
+    return 2 * _entropy(p + q) - _entropy(p) - _entropy(q)
+
+
+def _bhattacharya_1(s):
+    x = s.sum_sqrt_product
+    if x > 1:
+        x = 1
+    return np.power(np.arccos(x), 2)
+
+
+def _bhattacharya_2(s):
+    if s.sum_sqrt_product == 0:
+        return np.inf
+    else:
+        return -np.log(s.sum_sqrt_product)
+
+
+def _baroni_urbani_buser(s):
+    max_p, max_q = max(s.p), max(s.q)
+    max_pq = max_q if max_p < max_q else max_p
+    d1 = np.sqrt(np.sum(s.minimum * np.sum(max_pq - s.maximum)))
+    return 1 - (s.sum_minimum + d1) / (s.sum_maximum + d1)
+
+
+def _symmetric_chi_squared(s):
+    d1 = (s.p_avg + s.q_avg) / (s.n * np.power(s.p_avg + s.q_avg, 2))
+    return np.sqrt(d1 * np.sum(np.power(s.p * s.q_avg - s.q * s.p_avg, 2) / s.merged))
+
+
+def _pearson_correlation(s):
+    x = np.sum(s.q_centered * s.p_centered)
+    y = np.sqrt(np.sum(np.power(s.q_centered, 2)) * np.sum(np.power(s.p_centered, 2)))
+    if x == 0 and y == 0:
+        return 0.
+    else:
+        return -x / y
+
+
+def _dot_product(s):
+    score = np.power(s.sum_product, 2) / (s.sum_squared_q * s.sum_squared_p)
+    return 1 - np.sqrt(score)
+
+
+# The methods of math_distance, and ms_for_id_v1 of ms_distance, on the intermediate results of MatchedPeaks.
+# The methods missing here (ms_for_id, weighted_dot_product) need the m/z of the matched peaks.
+methods_on_matched_peaks = {
+    "entropy": _entropy_distance,
+    "unweighted_entropy": lambda s: 2 * s.entropy_merged - s.entropy_p - s.entropy_q,
+    "euclidean": lambda s: np.sqrt(s.sum_squared_diff),
+    "manhattan": lambda s: s.sum_abs_diff,
+    "chebyshev": lambda s: s.max_abs_diff,
+    "squared_euclidean": lambda s: s.sum_squared_diff,
+    "fidelity": lambda s: 1 - s.sum_sqrt_product,
+    "matusita": lambda s: np.sqrt(s.sum_squared_sqrt_diff),
+    "squared_chord": lambda s: s.sum_squared_sqrt_diff,
+    "bhattacharya_1": _bhattacharya_1,
+    "bhattacharya_2": _bhattacharya_2,
+    "harmonic_mean": lambda s: 1 - 2 * np.sum(s.product / s.merged),
+    "probabilistic_symmetric_chi_squared": lambda s: 1 / 2 * np.sum(s.squared_diff / s.merged),
+    "ruzicka": lambda s: s.sum_abs_diff / s.sum_maximum,
+    "roberts": lambda s: 1 - np.sum(s.merged / s.sum_merged * s.minimum / s.maximum),
+    "intersection": lambda s: 1 - s.sum_minimum / min(s.sum_p, s.sum_q),
+    "motyka": lambda s: -(s.sum_minimum / s.sum_merged),
+    "canberra": lambda s: np.sum(s.abs_diff / s.abs_merged),
+    "baroni_urbani_buser": _baroni_urbani_buser,
+    "penrose_size": lambda s: np.sqrt(s.n) * s.sum_abs_diff,
+    "mean_character": lambda s: 1 / s.n * s.sum_abs_diff,
+    "lorentzian": lambda s: np.sum(np.log(1 + s.abs_diff)),
+    "penrose_shape": lambda s: np.sqrt(np.sum(np.power(s.p_centered - s.q_centered, 2))),
+    "clark": lambda s: np.sqrt(1 / s.n * np.sum(np.power(s.diff / s.abs_merged, 2))),
+    "hellinger": lambda s: np.sqrt(2 * np.sum(np.power(np.sqrt(s.p_relative) - np.sqrt(s.q_relative), 2))),
+    "whittaker_index_of_association": lambda s: 1 / 2 * np.sum(np.abs(s.p_relative - s.q_relative)),
+    "symmetric_chi_squared": _symmetric_chi_squared,
+    "pearson_correlation": _pearson_correlation,
+    "improved_similarity": lambda s: np.sqrt(1 / s.n * np.sum(np.power(s.diff / s.merged, 2))),
+    "absolute_value": lambda s: s.sum_abs_diff / s.sum_p,
+    "dot_product": _dot_product,
+    "cosine": _dot_product,
+    "dot_product_reverse": lambda s: math_distance.dot_product_reverse_distance(s.p, s.q),
+    "spectral_contrast_angle": lambda s: 1 - s.sum_product / np.sqrt(s.sum_squared_q * s.sum_squared_p),
+    "wave_hedges": lambda s: np.sum(s.abs_diff / s.maximum),
+    "jaccard": lambda s: s.sum_squared_diff / (s.sum_squared_p + s.sum_squared_q - s.sum_product),
+    "dice": lambda s: s.sum_squared_diff / (s.sum_squared_p + s.sum_squared_q),
+    "inner_product": lambda s: 1 - s.sum_product,
+    "divergence": lambda s: 2 * np.sum(s.squared_diff / np.power(s.merged, 2)),
+    "avg_l": lambda s: s.sum_abs_diff + s.max_abs_diff,
+    "vicis_symmetric_chi_squared_3": lambda s: np.sum(s.squared_diff / s.maximum),
+    "ms_for_id_v1": lambda s: ms_distance._ms_for_id_v1_distance_on_matched_peaks(s.p, s.q),
+}
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import scipy.sparse
+
+from .parallel import split_blocks, state_pool, worker_state
+from .spectral_similarity import _distance_of_methods
+from .tools import check_spectrum, clean_spectra_batch
+
+
+def _similarity_of_rows(spectra, method, ms2_ppm, ms2_da, need_normalize_result, threshold, i_start, i_end):
+    """Compare spectrum i, i_start <= i < i_end, with every spectrum j >= i, and keep the pairs above threshold."""
+    rows, cols, values = [], [], []
+    for i in range(i_start, i_end):
+        for j in range(i, len(spectra)):
+            dist = _distance_of_methods(spectrum_query=spectra[i], spectrum_library=spectra[j], methods=[method],
+                                        need_clean_spectra=False, need_normalize_result=need_normalize_result,
+                                        ms2_ppm=ms2_ppm, ms2_da=ms2_da)[method]
+            value = 1 - dist if need_normalize_result else 0 - dist
+            if threshold is None or value > threshold:
+                rows.append(i)
+                cols.append(j)
+                values.append(value)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(values, dtype=np.float64)
+
+
+def _similarity_of_rows_in_worker(i_start, i_end):
+    return _similarity_of_rows(*worker_state["args"], i_start, i_end)
+
+
+def similarity_matrix(spectra: list, method: str = "entropy",
+                      ms2_ppm: float = None, ms2_da: float = None,
+                      need_clean_spectra: bool = True, need_normalize_result: bool = True,
+                      threshold: float = None, n_workers: int = None, chunk_size: int = 20000):
+    """
+    Calculate the similarity between every pair of spectra.
+    If both ms2_ppm and ms2_da is defined, ms2_da will be used.
+
+    Each spectrum is cleaned once. The pairs (i, j), i <= j, are compared in chunks of rows, in parallel over n_workers
+    processes when there is more than one chunk.
+
+    :param spectra: The spectra, each one in 2-D list or 2-D numpy array.
+    :param method: The similarity method, one of the methods of spectral_entropy.similarity.
+    :param ms2_ppm: The MS/MS tolerance in ppm.
+    :param ms2_da: The MS/MS tolerance in Da.
+    :param need_clean_spectra: Normalize spectra before comparing, required for not normalized spectrum.
+    :param need_normalize_result: Normalize the result into [0,1].
+    :param threshold: None to return the dense matrix. Otherwise only the pairs with similarity higher than threshold
+                      are kept, and a scipy.sparse.coo_matrix holding the upper triangle (i <= j) is returned.
+    :param n_workers: The number of processes, None to use all CPUs.
+    :param chunk_size: The number of pairs in each chunk.
+    :return: The symmetric N x N similarity matrix as a numpy array, or the sparse upper triangle when threshold is set.
+    """
+    if ms2_ppm is None and ms2_da is None:
+        raise ValueError("MS2 tolerance need to be defined!")
+
+    spectra = [check_spectrum(spectrum) for spectrum in spectra]
+    n_spectra = len(spectra)
+    if need_clean_spectra:
+        offsets = np.zeros(n_spectra + 1, dtype=np.int64)
+        np.cumsum([spectrum.shape[0] for spectrum in spectra], out=offsets[1:])
+        mz = np.concatenate([spectrum[:, 0] for spectrum in spectra] + [np.zeros(0, dtype=np.float32)])
+        intensity = np.concatenate([spectrum[:, 1] for spectrum in spectra] + [np.zeros(0, dtype=np.float32)])
+        mz, intensity, offsets = clean_spectra_batch(mz, intensity, offsets, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+        spectra = [np.column_stack((mz[start:end], intensity[start:end]))
+                   for start, end in zip(offsets[:-1], offsets[1:])]
+
+    # Row i of the upper triangle holds the pairs (i, j), j >= i.
+    chunks = split_blocks((n_spectra - i for i in range(n_spectra)), chunk_size)
+    args = (spectra, method, ms2_ppm, ms2_da, need_normalize_result, threshold)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(chunks))
+
+    if n_workers <= 1:
+        results = [_similarity_of_rows(*args, i_start, i_end) for i_start, i_end in chunks]
+    else:
+        with state_pool(n_workers, {"args": args}) as executor:
+            results = list(executor.map(_similarity_of_rows_in_worker, *zip(*chunks)))
+
+    rows = np.concatenate([result[0] for result in results] + [np.zeros(0, dtype=np.int64)])
+    cols = np.concatenate([result[1] for result in results] + [np.zeros(0, dtype=np.int64)])
+    values = np.concatenate([result[2] for result in results] + [np.zeros(0, dtype=np.float64)])
+
+    if threshold is not None:
+        return scipy.sparse.coo_matrix((values, (rows, cols)), shape=(n_spectra, n_spectra))
+    matrix = np.zeros((n_spectra, n_spectra), dtype=np.float64)
+    matrix[rows, cols] = values
+    matrix[cols, rows] = values
+    return matrix
@@ -0,0 +1,42 @@
+from concurrent.futures import ProcessPoolExecutor
+
+# The state shared by all tasks of a pool, set once per worker process by state_pool.
+worker_state = {}
+
+
+def _init_worker(state):
+    worker_state.clear()
+    worker_state.update(state)
+
+
+def state_pool(n_workers: int, state: dict) -> ProcessPoolExecutor:
+    """
+    A process pool whose processes receive the state shared by all tasks once, when they start, instead of with each
+    task. The tasks read it from worker_state, so they must be module-level functions.
+
+    :param n_workers: The number of processes.
+    :param state: The state shared by all tasks, e.g. the spectra and the parameters. Must be picklable.
+    :return: A concurrent.futures.ProcessPoolExecutor.
+    """
+    return ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(state,))
+
+
+def split_blocks(pairs_per_row, block_size: int) -> list:
+    """
+    Split consecutive rows into blocks holding about block_size pairs each.
+
+    :param pairs_per_row: The number of pairs of each row, e.g. n - 1 - i for the pairs (i, j), j > i.
+    :param block_size: The number of pairs in each block, a row is never split.
+    :return: A list of (first row, last row + 1) of each block.
+    """
+    blocks = []
+    i_start, n_pairs, n_rows = 0, 0, 0
+    for i, n_pairs_of_row in enumerate(pairs_per_row):
+        n_rows = i + 1
+        n_pairs += n_pairs_of_row
+        if n_pairs >= block_size:
+            blocks.append((i_start, i + 1))
+            i_start, n_pairs = i + 1, 0
+    if i_start < n_rows:
+        blocks.append((i_start, n_rows))
+    return blocks
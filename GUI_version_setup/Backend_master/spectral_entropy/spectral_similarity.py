@@ -2,8 +2,8 @@ import numpy as np
 from typing import Union
 
 try:
-    from . import math_distance, ms_distance
-    from .tools import clean_spectrum, match_peaks_in_spectra, normalize_distance
+    from . import fused_distance, math_distance, ms_distance
+    from .tools import check_spectrum, clean_spectrum, match_peaks_in_spectra, normalize_distance
 except:
     pass
 
@@ -166,12 +166,14 @@ def multiple_similarity(spectrum_query: Union[list, np.ndarray], spectrum_librar
     :return: A dict contains all similarity.
     """
     if methods:
-        result = {}
-        for m in methods:
-            s = similarity(spectrum_query=spectrum_query, spectrum_library=spectrum_library, method=m,
-                           need_clean_spectra=need_clean_spectra, need_normalize_result=need_normalize_result,
-                           ms2_ppm=ms2_ppm, ms2_da=ms2_da)
-            result[m] = float(s)
+        result = multiple_distance(spectrum_query=spectrum_query, spectrum_library=spectrum_library, methods=methods,
+                                   need_clean_spectra=need_clean_spectra, need_normalize_result=need_normalize_result,
+                                   ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+        for m in result:
+            if need_normalize_result:
+                result[m] = 1 - result[m]
+            else:
+                result[m] = 0 - result[m]
         return result
     else:
         return all_similarity(spectrum_query=spectrum_query, spectrum_library=spectrum_library,
@@ -207,8 +209,8 @@ def distance(spectrum_query: Union[list, np.ndarray], spectrum_library: Union[li
     if ms2_ppm is None and ms2_da is None:
         raise ValueError("MS2 tolerance need to be defined!")
 
-    spectrum_query = np.asarray(spectrum_query, dtype=np.float32)
-    spectrum_library = np.asarray(spectrum_library, dtype=np.float32)
+    spectrum_query = check_spectrum(spectrum_query)
+    spectrum_library = check_spectrum(spectrum_library)
     if need_clean_spectra:
         spectrum_query = clean_spectrum(spectrum_query, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
         spectrum_library = clean_spectrum(spectrum_library, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
@@ -263,10 +265,55 @@ def all_distance(spectrum_query: Union[list, np.ndarray], spectrum_library: Unio
 
     """
 
+    return _distance_of_methods(spectrum_query=spectrum_query, spectrum_library=spectrum_library,
+                                methods=list(methods_name),
+                                need_clean_spectra=need_clean_spectra, need_normalize_result=need_normalize_result,
+                                ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+
+
+def multiple_distance(spectrum_query: Union[list, np.ndarray], spectrum_library: Union[list, np.ndarray],
+                      methods: list = None,
+                      ms2_ppm: float = None, ms2_da: float = None,
+                      need_clean_spectra: bool = True, need_normalize_result: bool = True) -> dict:
+    """
+    Calculate multiple distance between two spectra, find common peaks.
+    If both ms2_ppm and ms2_da is defined, ms2_da will be used.
+
+    :param spectrum_query: The query spectrum, need to be in numpy array format.
+    :param spectrum_library: The library spectrum, need to be in numpy array format.
+    :param methods: A list of method names.
+    :param ms2_ppm: The MS/MS tolerance in ppm.
+    :param ms2_da: The MS/MS tolerance in Da.
+    :param need_clean_spectra: Normalize spectra before comparing, required for not normalized spectrum.
+    :param need_normalize_result: Normalize the result into [0,1].
+    :return: Distance between two spectra
+    """
+    if methods:
+        result = _distance_of_methods(spectrum_query=spectrum_query, spectrum_library=spectrum_library,
+                                      methods=methods,
+                                      need_clean_spectra=need_clean_spectra,
+                                      need_normalize_result=need_normalize_result,
+                                      ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+        return {m: float(dist) for m, dist in result.items()}
+    else:
+        return all_distance(spectrum_query=spectrum_query, spectrum_library=spectrum_library,
+                            need_clean_spectra=need_clean_spectra, need_normalize_result=need_normalize_result,
+                            ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+
+
+def _distance_of_methods(spectrum_query: Union[list, np.ndarray], spectrum_library: Union[list, np.ndarray],
+                         methods: list,
+                         ms2_ppm: float = None, ms2_da: float = None,
+                         need_clean_spectra: bool = True, need_normalize_result: bool = True) -> dict:
+    """
+    Calculate the distances of the given methods between two spectra.
+    The spectra are cleaned and the peaks are matched only once, and only the requested methods are evaluated.
+    The methods on the matched peaks share their intermediate results, see fused_distance.
+    """
     if ms2_ppm is None and ms2_da is None:
         raise ValueError("MS2 tolerance need to be defined!")
-    spectrum_query = np.asarray(spectrum_query, dtype=np.float32)
-    spectrum_library = np.asarray(spectrum_library, dtype=np.float32)
+    spectrum_query = check_spectrum(spectrum_query)
+    spectrum_library = check_spectrum(spectrum_library)
     if need_clean_spectra:
         spectrum_query = clean_spectrum(spectrum_query, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
         spectrum_library = clean_spectrum(spectrum_library, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
@@ -274,13 +321,15 @@ def all_distance(spectrum_query: Union[list, np.ndarray], spectrum_library: Unio
     # Calculate similarity
     result = {}
     if spectrum_query.shape[0] > 0 and spectrum_library.shape[0] > 0:
-        spec_matched = match_peaks_in_spectra(spec_a=spectrum_query, spec_b=spectrum_library,
-                                              ms2_ppm=ms2_ppm, ms2_da=ms2_da)
-        for method in methods_name:
+        matched_peaks = None
+        for method in methods:
             function_name = method + "_distance"
-            if hasattr(math_distance, function_name):
-                f = getattr(math_distance, function_name)
-                dist = f(spec_matched[:, 1], spec_matched[:, 2])
+            if method in fused_distance.methods_on_matched_peaks:
+                if matched_peaks is None:
+                    spec_matched = match_peaks_in_spectra(spec_a=spectrum_query, spec_b=spectrum_library,
+                                                          ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+                    matched_peaks = fused_distance.MatchedPeaks(spec_matched[:, 1], spec_matched[:, 2])
+                dist = fused_distance.methods_on_matched_peaks[method](matched_peaks)
             elif hasattr(ms_distance, function_name):
                 f = getattr(ms_distance, function_name)
                 dist = f(spectrum_query, spectrum_library, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
@@ -298,40 +347,9 @@ def all_distance(spectrum_query: Union[list, np.ndarray], spectrum_library: Unio
             result[method] = dist
 
     else:
-        for method in methods_name:
+        for method in methods:
             if need_normalize_result:
                 result[method] = 1
             else:
                 result[method] = np.inf
     return result
-
-
-def multiple_distance(spectrum_query: Union[list, np.ndarray], spectrum_library: Union[list, np.ndarray],
-                      methods: list = None,
-                      ms2_ppm: float = None, ms2_da: float = None,
-                      need_clean_spectra: bool = True, need_normalize_result: bool = True) -> dict:
-    """
-    Calculate multiple distance between two spectra, find common peaks.
-    If both ms2_ppm and ms2_da is defined, ms2_da will be used.
-
-    :param spectrum_query: The query spectrum, need to be in numpy array format.
-    :param spectrum_library: The library spectrum, need to be in numpy array format.
-    :param methods: A list of method names.
-    :param ms2_ppm: The MS/MS tolerance in ppm.
-    :param ms2_da: The MS/MS tolerance in Da.
-    :param need_clean_spectra: Normalize spectra before comparing, required for not normalized spectrum.
-    :param need_normalize_result: Normalize the result into [0,1].
-    :return: Distance between two spectra
-    """
-    if methods:
-        result = {}
-        for m in methods:
-            dist = distance(spectrum_query=spectrum_query, spectrum_library=spectrum_library, method=m,
-                            need_clean_spectra=need_clean_spectra, need_normalize_result=need_normalize_result,
-                            ms2_ppm=ms2_ppm, ms2_da=ms2_da)
-            result[m] = float(dist)
-        return result
-    else:
-        return all_distance(spectrum_query=spectrum_query, spectrum_library=spectrum_library,
-                            need_clean_spectra=need_clean_spectra, need_normalize_result=need_normalize_result,
-                            ms2_ppm=ms2_ppm, ms2_da=ms2_da)
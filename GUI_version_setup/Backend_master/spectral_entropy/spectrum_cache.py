@@ -0,0 +1,154 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from . import tools
+
+
+class SpectrumCache:
+    """
+    Keep the cleaned spectra in memory, so the same spectrum cleaned with the same parameters is only cleaned once.
+
+    A cleaned spectrum is found by the hash of the raw peaks (as float32) and of the cleaning parameters, so the cache
+    does not depend on where the spectrum comes from. The least recently used spectra are dropped when more than
+    max_size spectra are kept. When cache_dir is set, the cleaned spectra are also saved there as .npy files and read
+    back when they are not in memory, e.g. after a restart or in another process.
+    """
+
+    def __init__(self, max_size: int = 100000, cache_dir: str = None):
+        """
+        :param max_size: The number of cleaned spectra kept in memory.
+        :param cache_dir: The directory of the on-disk cache, None to only keep the spectra in memory.
+        """
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._spectra = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._spectra)
+
+    @staticmethod
+    def key(params: tuple, mz, intensity) -> str:
+        """The key of the spectrum with peaks (mz, intensity) cleaned with params."""
+        h = hashlib.blake2b(repr(params).encode(), digest_size=16)
+        h.update(np.ascontiguousarray(mz, dtype=np.float32))
+        h.update(np.ascontiguousarray(intensity, dtype=np.float32))
+        return h.hexdigest()
+
+    def _file_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def get(self, key: str):
+        """Return the cleaned spectrum of key, or None if it is not in the cache."""
+        with self._lock:
+            spectrum = self._spectra.get(key)
+            if spectrum is not None:
+                self._spectra.move_to_end(key)
+                self.hits += 1
+                return spectrum
+        if self.cache_dir is not None:
+            try:
+                spectrum = np.load(self._file_path(key))
+            except (OSError, ValueError):
+                spectrum = None
+            if spectrum is not None:
+                self._put_in_memory(key, spectrum)
+                with self._lock:
+                    self.hits += 1
+                return spectrum
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, spectrum: np.ndarray):
+        """Keep the cleaned spectrum of key, in memory and on disk."""
+        self._put_in_memory(key, spectrum)
+        if self.cache_dir is not None:
+            path = self._file_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written to a temporary file first, so that other processes never read a partial file.
+            temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            with open(temp_path, "wb") as f:
+                np.save(f, spectrum)
+            os.replace(temp_path, path)
+
+    def _put_in_memory(self, key, spectrum):
+        with self._lock:
+            self._spectra[key] = spectrum
+            self._spectra.move_to_end(key)
+            while len(self._spectra) > self.max_size:
+                self._spectra.popitem(last=False)
+
+    def clear(self):
+        """Drop the spectra kept in memory, the files in cache_dir are kept."""
+        with self._lock:
+            self._spectra.clear()
+
+    def clean_spectrum(self, spectrum,
+                       max_mz: float = None,
+                       noise_removal: float = 0.01,
+                       ms2_da: float = 0.05, ms2_ppm: float = None) -> np.ndarray:
+        """
+        The same as tools.clean_spectrum, the spectrum is only cleaned if not in the cache.
+        A copy of the cached spectrum is returned, so it can be modified.
+        """
+        spectrum = tools.check_spectrum(spectrum)
+        key = self.key(("spectrum", max_mz, noise_removal, ms2_da, ms2_ppm), spectrum[:, 0], spectrum[:, 1])
+        cleaned = self.get(key)
+        if cleaned is None:
+            cleaned = tools.clean_spectrum(spectrum, max_mz=max_mz, noise_removal=noise_removal,
+                                           ms2_da=ms2_da, ms2_ppm=ms2_ppm)
+            self.put(key, cleaned.copy())
+            return cleaned
+        return cleaned.copy()
+
+    def clean_spectra_batch(self, mz, intensity, offsets,
+                            max_mz=None,
+                            noise_removal: float = 0.01,
+                            ms2_da: float = 0.05, ms2_ppm: float = None):
+        """
+        The same as tools.clean_spectra_batch, only the spectra not in the cache are cleaned, in one batch.
+
+        :return: (mz, intensity, offsets) of the cleaned spectra, in the same layout. mz and intensity are float32.
+        """
+        mz = np.asarray(mz, dtype=np.float32).ravel()
+        intensity = np.asarray(intensity, dtype=np.float32).ravel()
+        offsets = np.asarray(offsets, dtype=np.int64)
+        n_spectra = offsets.shape[0] - 1
+        if max_mz is not None:
+            max_mz = np.broadcast_to(np.asarray(max_mz, dtype=np.float32), (n_spectra,))
+
+        cleaned = [None] * n_spectra
+        keys = [None] * n_spectra
+        for i in range(n_spectra):
+            start, end = offsets[i], offsets[i + 1]
+            params = ("batch", None if max_mz is None else float(max_mz[i]), noise_removal, ms2_da, ms2_ppm)
+            keys[i] = self.key(params, mz[start:end], intensity[start:end])
+            cleaned[i] = self.get(keys[i])
+
+        missing = [i for i in range(n_spectra) if cleaned[i] is None]
+        if missing:
+            missing_offsets = np.zeros(len(missing) + 1, dtype=np.int64)
+            np.cumsum(offsets[1:][missing] - offsets[:-1][missing], out=missing_offsets[1:])
+            peaks = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in missing])
+            missing_mz, missing_intensity, missing_offsets = tools.clean_spectra_batch(
+                mz[peaks], intensity[peaks], missing_offsets,
+                max_mz=None if max_mz is None else max_mz[missing],
+                noise_removal=noise_removal, ms2_da=ms2_da, ms2_ppm=ms2_ppm)
+            for k, i in enumerate(missing):
+                start, end = missing_offsets[k], missing_offsets[k + 1]
+                cleaned[i] = np.column_stack((missing_mz[start:end], missing_intensity[start:end]))
+                self.put(keys[i], cleaned[i])
+
+        new_offsets = np.zeros(n_spectra + 1, dtype=np.int64)
+        np.cumsum([spectrum.shape[0] for spectrum in cleaned], out=new_offsets[1:])
+        cleaned = np.concatenate(cleaned + [np.zeros((0, 2), dtype=np.float32)])
+        return cleaned[:, 0].copy(), cleaned[:, 1].copy(), new_offsets
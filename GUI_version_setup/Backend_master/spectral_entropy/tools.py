@@ -1,12 +1,53 @@
+import os
+
 import numpy as np
 
-try:
-    from . import tools_fast
-except Exception as e:
-    print("Compile the cython code is highly recommended!")
+
+def _load_tools_fast():
+    """
+    Import the Cython extension tools_fast, built with "python setup.py build_ext --inplace". If it is not compiled
+    for this platform, the pure Python implementation is used, unless the environment variable
+    SPECTRAL_ENTROPY_BUILD=1 is set: then it is built with pyximport, which needs Cython and a C compiler. That build is
+    cached, so it only happens on the first import.
+
+    :return: The tools_fast module, or None if it can not be imported or built.
+    """
+    try:
+        from . import tools_fast
+        return tools_fast
+    except ImportError:
+        pass
+
+    if os.environ.get("SPECTRAL_ENTROPY_BUILD", "0") != "1":
+        return None
+    try:
+        import pyximport
+        importers = pyximport.install(setup_args={"include_dirs": np.get_include()}, language_level=3)
+        try:
+            from . import tools_fast
+        finally:
+            pyximport.uninstall(*importers)
+        return tools_fast
+    except Exception:
+        return None
+
+
+tools_fast = _load_tools_fast()
+
+# The implementation used by centroid_spec and match_peaks_in_spectra: "cython", or "python" without tools_fast.
+BACKEND = "python" if tools_fast is None else "cython"
+
+
+def get_backend() -> str:
+    """Return the implementation used for centroiding and peak matching, "cython" or "python"."""
+    return BACKEND
 
 
 def check_spectrum(spectrum):
+    """
+    Return the spectrum as a C-contiguous float32 2-D numpy array, the format used through the package.
+    A spectrum already in this format is returned as it is, without copy.
+    """
     if len(spectrum) == 0:
         return np.zeros(0, dtype=np.float32).reshape(-1, 2)
     spectrum = np.asarray(spectrum, dtype=np.float32, order="C")
@@ -26,6 +67,26 @@ def standardize_spectrum(spectrum):
     return spectrum
 
 
+def _segment_sums(values, offsets):
+    """
+    The sum of each segment values[offsets[i]:offsets[i + 1]], 0 for an empty segment.
+
+    np.add.reduceat adds the values of each segment in order, in float64, so clean_spectrum and clean_spectra_batch,
+    which both sum the intensities with this function, get the same sums to the last bit.
+
+    :param values: The values of all segments, in a 1-D numpy array.
+    :param offsets: The start of each segment in values, followed by the end of the last one.
+    :return: The sums, in the dtype of values.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sums = np.zeros(offsets.shape[0] - 1, dtype=values.dtype)
+    not_empty = offsets[1:] > offsets[:-1]
+    if not_empty.any():
+        # reduceat gives the value at the start of an empty segment instead of 0: only sum the other ones.
+        sums[not_empty] = np.add.reduceat(values, offsets[:-1][not_empty], dtype=np.float64)
+    return sums
+
+
 def clean_spectrum(spectrum,
                    max_mz: float = None,
                    noise_removal: float = 0.01,
@@ -49,89 +110,203 @@ def clean_spectrum(spectrum,
     if ms2_da is None and ms2_ppm is None:
         raise RuntimeError("MS2 tolerance need to be set!")
 
+    # 1. Remove the precursor ions, and 2. centroid peaks.
+    # The peaks kept are gathered in m/z order in one copy, which the following steps own.
+    if max_mz is not None:
+        keep = np.flatnonzero(spectrum[:, 0] <= max_mz)
+        spectrum = spectrum[keep[np.argsort(spectrum[keep, 0])]]
+    else:
+        spectrum = spectrum[np.argsort(spectrum[:, 0])]
+    spectrum = centroid_spec(spectrum, ms2_da=ms2_da, ms2_ppm=ms2_ppm)
+
+    # 3. Remove noise ions, and 4. standardize the spectrum, again in one copy.
+    if noise_removal is not None and spectrum.shape[0] > 0:
+        max_intensity = np.max(spectrum[:, 1])
+        keep = np.flatnonzero(spectrum[:, 1] >= max_intensity * noise_removal)
+        spectrum = spectrum[keep[np.argsort(spectrum[keep, 0])]]
+    else:
+        spectrum = spectrum[np.argsort(spectrum[:, 0])]
+    intensity_sum = _segment_sums(spectrum[:, 1], [0, spectrum.shape[0]])[0]
+    if intensity_sum > 0:
+        spectrum[:, 1] /= intensity_sum
+    return spectrum
+
+
+def clean_spectra_batch(mz, intensity, offsets,
+                        max_mz=None,
+                        noise_removal: float = 0.01,
+                        ms2_da: float = 0.05, ms2_ppm: float = None):
+    """
+    Clean many spectra at once, with the same procedures as clean_spectrum.
+
+    The spectra are given in a ragged layout: the peaks of spectrum i are mz[offsets[i]:offsets[i + 1]] and
+    intensity[offsets[i]:offsets[i + 1]]. The m/z filtering, sorting, noise removal and normalization are done for all
+    spectra together; only the spectra having peaks closer than the MS/MS tolerance are centroided one by one.
+
+    :param mz: The m/z of all peaks.
+    :param intensity: The intensity of all peaks.
+    :param offsets: The start of each spectrum in mz and intensity, followed by the total number of peaks.
+    :param max_mz: The ions with m/z higher than max_mz will be removed. A single value, or one value per spectrum.
+    :param noise_removal: The ions with intensity lower than max ion's intensity * noise_removal will be removed.
+    :param ms2_da: The MS/MS tolerance in Da.
+    :param ms2_ppm: The MS/MS tolerance in ppm.
+    If both ms2_da and ms2_ppm is given, ms2_da will be used.
+    :return: (mz, intensity, offsets) of the cleaned spectra, in the same layout. mz and intensity are float32.
+    """
+    # Check parameter
+    if ms2_da is None and ms2_ppm is None:
+        raise RuntimeError("MS2 tolerance need to be set!")
+    mz = np.asarray(mz, dtype=np.float32).ravel()
+    intensity = np.asarray(intensity, dtype=np.float32).ravel()
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_spectra = offsets.shape[0] - 1
+    row = np.repeat(np.arange(n_spectra), np.diff(offsets))
+
     # 1. Remove the precursor ions
     if max_mz is not None:
-        spectrum = spectrum[spectrum[:, 0] <= max_mz]
+        max_mz = np.broadcast_to(np.asarray(max_mz, dtype=np.float32), (n_spectra,))
+        keep = mz <= max_mz[row]
+        mz, intensity, row = mz[keep], intensity[keep], row[keep]
 
     # 2. Centroid peaks
-    spectrum = spectrum[np.argsort(spectrum[:, 0])]
-    spectrum = centroid_spec(spectrum, ms2_da=ms2_da, ms2_ppm=ms2_ppm)
+    order = np.lexsort((mz, row))
+    mz, intensity, row = mz[order], intensity[order], row[order]
+    same_spectrum = row[1:] == row[:-1]
+    if ms2_da is not None:
+        too_close = (mz[1:] - mz[:-1]) <= ms2_da
+    else:
+        too_close = (mz[1:] - mz[:-1]) / mz[1:] * 1e6 <= ms2_ppm
+    need_centroid = np.unique(row[1:][same_spectrum & too_close])
+    if need_centroid.shape[0] > 0:
+        start = np.searchsorted(row, need_centroid, side="left")
+        end = np.searchsorted(row, need_centroid, side="right")
+        centroided = [centroid_spec(np.column_stack((mz[s:e], intensity[s:e])), ms2_da=ms2_da, ms2_ppm=ms2_ppm)
+                      for s, e in zip(start, end)]
+        keep = ~np.isin(row, need_centroid)
+        mz = np.concatenate([mz[keep]] + [spec[:, 0] for spec in centroided]).astype(np.float32)
+        intensity = np.concatenate([intensity[keep]] + [spec[:, 1] for spec in centroided]).astype(np.float32)
+        row = np.concatenate([row[keep]] + [np.full(spec.shape[0], i) for i, spec in zip(need_centroid, centroided)])
+        # Each spectrum is already sorted by m/z, only put the spectra back in order.
+        order = np.argsort(row, kind="stable")
+        mz, intensity, row = mz[order], intensity[order], row[order]
+
+    n_peaks = np.bincount(row, minlength=n_spectra)
+    has_peaks = n_peaks > 0
+    start = np.concatenate(([0], np.cumsum(n_peaks)[:-1]))
 
     # 3. Remove noise ions
-    if noise_removal is not None and spectrum.shape[0] > 0:
-        max_intensity = np.max(spectrum[:, 1])
-        spectrum = spectrum[spectrum[:, 1] >= max_intensity * noise_removal]
+    if noise_removal is not None and mz.shape[0] > 0:
+        max_intensity = np.zeros(n_spectra, dtype=np.float32)
+        max_intensity[has_peaks] = np.maximum.reduceat(intensity, start[has_peaks])
+        # Same rounding as clean_spectrum: the threshold is computed in float64 and compared in float32.
+        threshold = (max_intensity.astype(np.float64) * noise_removal).astype(np.float32)
+        keep = intensity >= threshold[row]
+        mz, intensity, row = mz[keep], intensity[keep], row[keep]
+        n_peaks = np.bincount(row, minlength=n_spectra)
 
-    # 4. Standardize the spectrum.
-    spectrum = standardize_spectrum(spectrum)
-    return spectrum
+    offsets = np.zeros(n_spectra + 1, dtype=np.int64)
+    np.cumsum(n_peaks, out=offsets[1:])
+
+    # 4. Standardize the spectrum, with the same sums as clean_spectrum.
+    scale = _segment_sums(intensity, offsets)[row]
+    intensity = np.where(scale > 0, intensity / np.where(scale > 0, scale, 1), intensity).astype(np.float32)
+    return mz, intensity, offsets
 
 
 def centroid_spec(spec, ms2_ppm=None, ms2_da=None):
-    try:
-        return tools_fast.centroid_spec(spec, ms2_ppm, ms2_da)
-    except Exception as e:
-        pass
     """
     If both ms2_ppm and ms2_da is defined, ms2_da will be used.
     """
-    # Fast check is the spectrum need centroid.
-    mz_array = spec[:, 0]
-    need_centroid = 0
-    if mz_array.shape[0] > 1:
-        mz_delta = mz_array[1:] - mz_array[:-1]
-        if ms2_da is not None:
-            if np.min(mz_delta) <= ms2_da:
-                need_centroid = 1
-        else:
-            if np.min(mz_delta / mz_array[1:] * 1e6) <= ms2_ppm:
-                need_centroid = 1
-
-    if need_centroid:
-        intensity_order = np.argsort(-spec[:, 1])
-        spec_new = []
-        for i in intensity_order:
-            if ms2_da is None:
-                if ms2_ppm is None:
-                    raise RuntimeError("MS2 tolerance not defined.")
-                else:
-                    mz_delta_allowed = ms2_ppm * 1e-6 * spec[i, 0]
-            else:
-                mz_delta_allowed = ms2_da
-
-            if spec[i, 1] > 0:
-                # Find left board for current peak
-                i_left = i - 1
-                while i_left >= 0:
-                    mz_delta_left = spec[i, 0] - spec[i_left, 0]
-                    if mz_delta_left <= mz_delta_allowed:
-                        i_left -= 1
-                    else:
-                        break
-                i_left += 1
-
-                # Find right board for current peak
-                i_right = i + 1
-                while i_right < spec.shape[0]:
-                    mz_delta_right = spec[i_right, 0] - spec[i, 0]
-                    if mz_delta_right <= mz_delta_allowed:
-                        i_right += 1
-                    else:
-                        break
-
-                # Merge those peaks
-                intensity_sum = np.sum(spec[i_left:i_right, 1])
-                intensity_weighted_sum = np.sum(spec[i_left:i_right, 0] * spec[i_left:i_right, 1])
-
-                spec_new.append([intensity_weighted_sum / intensity_sum, intensity_sum])
-                spec[i_left:i_right, 1] = 0
-
-        spec_new = np.array(spec_new)
-        # Sort by m/z
-        spec_new = spec_new[np.argsort(spec_new[:, 0])]
-        return spec_new
+    if tools_fast is not None:
+        # tools_fast returns an 1-D array for empty spectrum.
+        return tools_fast.centroid_spec(spec, ms2_ppm, ms2_da).reshape(-1, 2)
+    return _centroid_spec_numpy(spec, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
+
+
+def _centroid_spec_numpy(spec, ms2_ppm=None, ms2_da=None):
+    """
+    The numpy version of tools_fast.centroid_spec, with the same result.
+    The spectrum need to be sorted by m/z. It is centroided again until no peaks are closer than the tolerance.
+    """
+    if ms2_da is None and ms2_ppm is None:
+        raise RuntimeError("MS2 tolerance not defined.")
+    spec = np.asarray(spec, dtype=np.float32).reshape(-1, 2)
+    while _check_centroid(spec[:, 0], ms2_ppm, ms2_da):
+        spec = _centroid_spec_once(spec, ms2_ppm, ms2_da)
+        spec = spec[np.argsort(spec[:, 0])]
+    return spec
+
+
+def _check_centroid(mz, ms2_ppm, ms2_da):
+    """Fast check is the spectrum need centroid, in float32 as tools_fast.check_centroid_c."""
+    if mz.shape[0] <= 1:
+        return False
+    mz_delta = mz[1:] - mz[:-1]
+    if ms2_da is not None:
+        return bool(np.any(mz_delta < np.float32(ms2_da)))
+    return bool(np.any((mz_delta / mz[:-1]).astype(np.float64) * 1e6 <= np.float32(ms2_ppm)))
+
+
+def _centroid_spec_once(spec, ms2_ppm, ms2_da):
+    """
+    Merge the peaks from the most intense one: each peak not merged yet takes all the peaks not merged yet within the
+    tolerance around it.
+
+    Instead of going through the peaks one by one, the peaks are split into groups separated by more than the largest
+    tolerance. The most intense peak of a group is never taken by a peak of another group, so it merges its
+    neighbours, in all groups at once. Then the groups are split again among the peaks left, until none is left.
+    """
+    mz, intensity = spec[:, 0], spec[:, 1]
+    n_peaks = mz.shape[0]
+    # The same peak order as tools_fast, also for peaks with the same intensity.
+    intensity_order = np.argsort(intensity)
+    rank = np.empty(n_peaks, dtype=np.int64)
+    rank[intensity_order] = np.arange(n_peaks)
+    if ms2_da is not None:
+        mz_delta_allowed = np.full(n_peaks, ms2_da, dtype=np.float32)
     else:
-        return spec
+        mz_delta_allowed = (np.float64(np.float32(ms2_ppm)) * 1e-6 * mz.astype(np.float64)).astype(np.float32)
+    group_gap = np.max(mz_delta_allowed)
+    weighted_intensity = mz * intensity
+
+    merged_rank, merged_intensity, merged_weighted_intensity = [], [], []
+    remaining = np.arange(n_peaks)
+    while remaining.shape[0] > 0:
+        mz_remaining = mz[remaining]
+        new_group = np.concatenate(([True], (mz_remaining[1:] - mz_remaining[:-1]) > group_gap))
+        group = np.cumsum(new_group) - 1
+        # The peaks with intensity 0 never merge others.
+        candidate = np.where(intensity[remaining] > 0, rank[remaining], -1)
+        top_rank = np.maximum.reduceat(candidate, np.flatnonzero(new_group))
+        has_top = top_rank >= 0
+        top = intensity_order[np.where(has_top, top_rank, 0)][group]
+
+        in_window = has_top[group] & (mz[top] - mz_remaining <= mz_delta_allowed[top]) & \
+            (mz_remaining - mz[top] <= mz_delta_allowed[top])
+        merged = remaining[in_window]
+        merged_group = group[in_window]
+
+        # Sum the merged peaks one after the other in m/z order, in float32 as tools_fast does.
+        group_start = np.flatnonzero(np.diff(merged_group, prepend=-1))
+        group_size = np.diff(np.append(group_start, merged.shape[0]))
+        intensity_sum = np.zeros(group_start.shape[0], dtype=np.float32)
+        intensity_weighted_sum = np.zeros(group_start.shape[0], dtype=np.float32)
+        for k in range(int(group_size.max(initial=0))):
+            g = np.flatnonzero(group_size > k)
+            intensity_sum[g] += intensity[merged[group_start[g] + k]]
+            intensity_weighted_sum[g] += weighted_intensity[merged[group_start[g] + k]]
+
+        merged_rank.append(top_rank[merged_group[group_start]])
+        merged_intensity.append(intensity_sum)
+        merged_weighted_intensity.append(intensity_weighted_sum)
+        # The groups without peak of intensity > 0 are dropped.
+        remaining = remaining[has_top[group] & ~in_window]
+
+    # The merged peaks in the order they are made by tools_fast.
+    order = np.argsort(-np.concatenate(merged_rank + [np.zeros(0, dtype=np.int64)]))
+    intensity_sum = np.concatenate(merged_intensity + [np.zeros(0, dtype=np.float32)])[order]
+    intensity_weighted_sum = np.concatenate(merged_weighted_intensity + [np.zeros(0, dtype=np.float32)])[order]
+    return np.column_stack((intensity_weighted_sum / intensity_sum, intensity_sum))
 
 
 def match_peaks_in_spectra(spec_a, spec_b, ms2_ppm=None, ms2_da=None):
@@ -140,104 +315,159 @@ def match_peaks_in_spectra(spec_a, spec_b, ms2_ppm=None, ms2_da=None):
     :return: list. Each element in the list is a list contain three elements:
                               m/z, intensity from spec 1; intensity from spec 2.
     """
-    try:
+    # tools_fast only handles the tolerance in Da correctly.
+    if tools_fast is not None and ms2_da is not None:
         return tools_fast.match_spectrum(spec_a, spec_b, ms2_ppm=ms2_ppm, ms2_da=ms2_da)
-    except Exception as e:
-        pass
+    return _match_peaks(*_spectrum_arrays(spec_a), *_spectrum_arrays(spec_b), ms2_ppm, ms2_da, with_mz_info=False)[0]
 
-    a = 0
-    b = 0
-
-    spec_merged = []
-    peak_b_int = 0.
-
-    while a < spec_a.shape[0] and b < spec_b.shape[0]:
-        if ms2_da is None:
-            ms2_da = ms2_ppm * spec_a[a, 0] * 1e6
-        mass_delta = spec_a[a, 0] - spec_b[b, 0]
-
-        if mass_delta < -ms2_da:
-            # Peak only existed in spec a.
-            spec_merged.append([spec_a[a, 0], spec_a[a, 1], peak_b_int])
-            peak_b_int = 0.
-            a += 1
-        elif mass_delta > ms2_da:
-            # Peak only existed in spec b.
-            spec_merged.append([spec_b[b, 0], 0., spec_b[b, 1]])
-            b += 1
-        else:
-            # Peak existed in both spec.
-            peak_b_int += spec_b[b, 1]
-            b += 1
 
-    if peak_b_int > 0.:
-        spec_merged.append([spec_a[a, 0], spec_a[a, 1], peak_b_int])
-        peak_b_int = 0.
-        a += 1
+def match_peaks_with_mz_info_in_spectra(spec_a, spec_b, ms2_ppm=None, ms2_da=None):
+    """
+    Match two spectra, find common peaks. If both ms2_ppm and ms2_da is defined, ms2_da will be used.
+    :return: list. Each element in the list is a list contain three elements:
+                              m/z from spec 1; intensity from spec 1; m/z from spec 2; intensity from spec 2.
+    """
+    return _match_peaks(*_spectrum_arrays(spec_a), *_spectrum_arrays(spec_b), ms2_ppm, ms2_da, with_mz_info=True)[0]
 
-    if b < spec_b.shape[0]:
-        spec_merged += [[x[0], 0., x[1]] for x in spec_b[b:]]
 
-    if a < spec_a.shape[0]:
-        spec_merged += [[x[0], x[1], 0.] for x in spec_a[a:]]
+def match_peaks_in_spectra_batch(spectra_a: list, spectra_b: list, ms2_ppm=None, ms2_da=None) -> list:
+    """
+    Match many pairs of spectra at once, spectra_a[i] with spectra_b[i], with the numpy version of
+    match_peaks_in_spectra. The spectra need to be sorted by m/z.
+    If both ms2_ppm and ms2_da is defined, ms2_da will be used.
 
-    if spec_merged:
-        spec_merged = np.array(spec_merged, dtype=np.float64)
-    else:
-        spec_merged = np.array([[0., 0., 0.]], dtype=np.float64)
-    return spec_merged
+    :return: The matched peaks of each pair, in the format of match_peaks_in_spectra.
+    """
+    if len(spectra_a) != len(spectra_b):
+        raise ValueError("spectra_a and spectra_b need to have the same length!")
+    return _match_peaks(*_spectrum_arrays(*spectra_a), *_spectrum_arrays(*spectra_b), ms2_ppm, ms2_da,
+                        with_mz_info=False)
 
 
-def match_peaks_with_mz_info_in_spectra(spec_a, spec_b, ms2_ppm=None, ms2_da=None):
+def match_peaks_with_mz_info_in_spectra_batch(spectra_a: list, spectra_b: list, ms2_ppm=None, ms2_da=None) -> list:
     """
-    Match two spectra, find common peaks. If both ms2_ppm and ms2_da is defined, ms2_da will be used.
-    :return: list. Each element in the list is a list contain three elements:
-                              m/z from spec 1; intensity from spec 1; m/z from spec 2; intensity from spec 2.
+    Match many pairs of spectra at once, spectra_a[i] with spectra_b[i], with the same result as
+    match_peaks_with_mz_info_in_spectra. The spectra need to be sorted by m/z.
+    If both ms2_ppm and ms2_da is defined, ms2_da will be used.
+
+    :return: The matched peaks of each pair, in the format of match_peaks_with_mz_info_in_spectra.
     """
-    a = 0
-    b = 0
-
-    spec_merged = []
-    peak_b_mz = 0.
-    peak_b_int = 0.
-
-    while a < spec_a.shape[0] and b < spec_b.shape[0]:
-        mass_delta_ppm = (spec_a[a, 0] - spec_b[b, 0]) / spec_a[a, 0] * 1e6
-        if ms2_da is not None:
-            ms2_ppm = ms2_da / spec_a[a, 0] * 1e6
-        if mass_delta_ppm < -ms2_ppm:
-            # Peak only existed in spec a.
-            spec_merged.append([spec_a[a, 0], spec_a[a, 1], peak_b_mz, peak_b_int])
-            peak_b_mz = 0.
-            peak_b_int = 0.
-            a += 1
-        elif mass_delta_ppm > ms2_ppm:
-            # Peak only existed in spec b.
-            spec_merged.append([0., 0., spec_b[b, 0], spec_b[b, 1]])
-            b += 1
-        else:
-            # Peak existed in both spec.
-            peak_b_mz = ((peak_b_mz * peak_b_int) + (spec_b[b, 0] * spec_b[b, 1])) / (peak_b_int + spec_b[b, 1])
-            peak_b_int += spec_b[b, 1]
-            b += 1
+    if len(spectra_a) != len(spectra_b):
+        raise ValueError("spectra_a and spectra_b need to have the same length!")
+    return _match_peaks(*_spectrum_arrays(*spectra_a), *_spectrum_arrays(*spectra_b), ms2_ppm, ms2_da,
+                        with_mz_info=True)
+
+
+def _spectrum_arrays(*spectra):
+    """The m/z, intensity and offsets of the spectra, all peaks put one after the other."""
+    if len(spectra) == 1:
+        peaks = np.asarray(spectra[0]).reshape(-1, 2)
+        return peaks[:, 0], peaks[:, 1], np.array([0, peaks.shape[0]])
+    spectra = [np.asarray(spectrum).reshape(-1, 2) for spectrum in spectra]
+    offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+    np.cumsum([spectrum.shape[0] for spectrum in spectra], out=offsets[1:])
+    peaks = np.concatenate(spectra + [np.zeros((0, 2), dtype=np.float32)])
+    return peaks[:, 0], peaks[:, 1], offsets
 
-    if peak_b_int > 0.:
-        spec_merged.append([spec_a[a, 0], spec_a[a, 1], peak_b_mz, peak_b_int])
-        peak_b_mz = 0.
-        peak_b_int = 0.
-        a += 1
 
-    if b < spec_b.shape[0]:
-        spec_merged += [[0., 0., x[0], x[1]] for x in spec_b[b:]]
+def _match_peaks(mz_a, intensity_a, offsets_a, mz_b, intensity_b, offsets_b, ms2_ppm, ms2_da, with_mz_info):
+    """
+    The numpy version of the peak matching of match_peaks_in_spectra and match_peaks_with_mz_info_in_spectra, for the
+    pairs of spectra given by offsets_a and offsets_b.
+
+    The matching goes through the peaks of the two spectra in m/z order, like a merge: each peak b is merged into the
+    first peak a which is not more than the tolerance below it, when b is within the tolerance of this peak a.
+    Here this peak a is found by binary search for all peaks b at once, then the rows are put in the order of the merge.
+    The tolerance is checked with the arithmetic of the loop version, in ppm of peak a for
+    match_peaks_with_mz_info_in_spectra and in Da otherwise.
+    """
+    if ms2_ppm is None and ms2_da is None:
+        raise RuntimeError("MS2 tolerance need to be set!")
+    n_pairs = offsets_a.shape[0] - 1
+    n_a = mz_a.shape[0]
+    pair_a = np.repeat(np.arange(n_pairs), np.diff(offsets_a))
+    pair_b = np.repeat(np.arange(n_pairs), np.diff(offsets_b))
 
-    if a < spec_a.shape[0]:
-        spec_merged += [[x[0], x[1], 0., 0.] for x in spec_a[a:]]
+    mz_a_64 = mz_a.astype(np.float64)
+    if with_mz_info:
+        tolerance = ms2_ppm if ms2_da is None else ms2_da / mz_a_64 * 1e6
+
+        def mass_delta(a, b):
+            return ((mz_a[a] - mz_b[b]) / mz_a[a]).astype(np.float64) * 1e6
+    else:
+        tolerance = ms2_da if ms2_da is not None else ms2_ppm * 1e-6 * mz_a_64
+
+        def mass_delta(a, b):
+            return (mz_a[a] - mz_b[b]).astype(np.float64)
+    tolerance = np.broadcast_to(tolerance, mz_a.shape)
+
+    # Find the first peak a not more than the tolerance below each peak b, in the same pair of spectra.
+    # The binary search on m/z is only a first guess, which is then moved to the exact position.
+    first_a, last_a = offsets_a[pair_b], offsets_a[pair_b + 1]
+    upper_mz_a = mz_a_64 + (tolerance * 1e-6 * mz_a_64 if with_mz_info else tolerance)
+    pair_width = 2 * max(np.max(upper_mz_a, initial=0), np.max(mz_b, initial=0)) + 1
+    position = np.searchsorted(upper_mz_a + pair_a * pair_width, mz_b + pair_b * pair_width, side="left")
+    position = np.clip(position, first_a, last_a)
+    while True:
+        check = np.flatnonzero(position > first_a)
+        move = check[mass_delta(position[check] - 1, check) >= -tolerance[position[check] - 1]]
+        if move.shape[0] == 0:
+            break
+        position[move] -= 1
+    while True:
+        check = np.flatnonzero(position < last_a)
+        move = check[mass_delta(position[check], check) < -tolerance[position[check]]]
+        if move.shape[0] == 0:
+            break
+        position[move] += 1
+    # The merge never goes back to a previous peak a.
+    position = np.maximum.accumulate(position) if position.shape[0] > 0 else position
+
+    matched = position < last_a
+    matched[matched] = mass_delta(position[matched], np.flatnonzero(matched)) <= tolerance[position[matched]]
+    matched_b = np.flatnonzero(matched)
+    matched_a = position[matched_b]
+    unmatched_b = np.flatnonzero(~matched)
+
+    # The peaks b merged into each peak a, summed one after the other: in float32 as tools_fast.match_spectrum does,
+    # and in float64 for the m/z info as the loop version.
+    dtype = np.float64 if with_mz_info else np.float32
+    merged_intensity = np.zeros(n_a, dtype=dtype)
+    merged_mz = np.zeros(n_a, dtype=dtype)
+    weighted_intensity_b = mz_b * intensity_b if with_mz_info else None
+    group_start = np.flatnonzero(np.diff(matched_a, prepend=-1))
+    group_size = np.diff(np.append(group_start, matched_a.shape[0]))
+    for k in range(int(group_size.max(initial=0))):
+        g = group_start[group_size > k]
+        a, b = matched_a[g + k], matched_b[g + k]
+        if with_mz_info:
+            merged_mz[a] = ((merged_mz[a] * merged_intensity[a]) + weighted_intensity_b[b]) / \
+                (merged_intensity[a] + intensity_b[b])
+        merged_intensity[a] += intensity_b[b]
+
+    # Put the rows in the order of the merge: peak a comes just before the first peak b merged into a later peak a.
+    b_after_a = np.searchsorted(position, np.arange(n_a), side="right")
+    row_a = np.arange(n_a) + np.searchsorted(unmatched_b, b_after_a, side="left")
+    row_b = np.arange(unmatched_b.shape[0]) + np.searchsorted(b_after_a, unmatched_b, side="right")
+    spec_merged = np.zeros((n_a + unmatched_b.shape[0], 4 if with_mz_info else 3), dtype=dtype)
+    spec_merged[row_a, 0] = mz_a
+    spec_merged[row_a, 1] = intensity_a
+    spec_merged[row_a, -1] = merged_intensity
+    if with_mz_info:
+        spec_merged[row_a, 2] = merged_mz
+        spec_merged[row_b, 2] = mz_b[unmatched_b]
+    else:
+        spec_merged[row_b, 0] = mz_b[unmatched_b]
+    spec_merged[row_b, -1] = intensity_b[unmatched_b]
 
-    if spec_merged:
-        spec_merged = np.array(spec_merged, dtype=np.float64)
+    if n_pairs == 1:
+        spec_merged = [spec_merged]
     else:
-        spec_merged = np.array([[0., 0., 0., 0.]], dtype=np.float64)
-    return spec_merged
+        n_rows = np.diff(offsets_a) + np.bincount(pair_b[unmatched_b], minlength=n_pairs)
+        spec_merged = np.split(spec_merged, np.cumsum(n_rows)[:-1])
+    # Pairs without any peak give one row of 0, as the loop version.
+    return [spectrum if spectrum.shape[0] > 0 else np.zeros((1, spectrum.shape[1]), dtype=dtype)
+            for spectrum in spec_merged]
 
 
 def normalize_distance(dist, dist_range):
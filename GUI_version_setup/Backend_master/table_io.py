@@ -0,0 +1,93 @@
+import gzip
+import io
+
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+CSV_MIMETYPE = "text/csv"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+
+class UnsupportedEncoding(ValueError):
+    """The request body is compressed in a format which cannot be read."""
+
+
+def request_encodings() -> tuple:
+    """The Content-Encoding values of the request bodies which can be read."""
+    encodings = ("identity", "gzip")
+    if zstandard is not None:
+        encodings += ("zstd",)
+    return encodings
+
+
+def output_formats() -> tuple:
+    """The formats the tables can be sent in."""
+    return ("csv", "arrow") if pyarrow is not None else ("csv",)
+
+
+def open_body(stream, content_encoding: str = None):
+    """
+    Decompress a request body on the fly, without reading it all in memory or on disk first.
+
+    :param stream: The body as a binary file-like object, read sequentially.
+    :param content_encoding: The Content-Encoding of the body: None, "identity", "gzip" or "zstd".
+    :return: A binary file-like object of the decompressed body.
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return stream
+    if encoding in ("gzip", "x-gzip"):
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise UnsupportedEncoding("Unsupported Content-Encoding: {}, supported: {}".format(
+        content_encoding, ", ".join(request_encodings())))
+
+
+def read_table(stream, content_encoding: str = None, sep: str = ",") -> pd.DataFrame:
+    """
+    Parse a (compressed) delimited table from a request body.
+
+    The body is decompressed while the parser reads it, so neither the whole compressed body nor the whole
+    decompressed text is held in memory or written to disk. The parsed table itself is built whole, in memory.
+
+    :param stream: The body as a binary file-like object, read sequentially.
+    :param content_encoding: The Content-Encoding of the body: None, "identity", "gzip" or "zstd".
+    :param sep: The delimiter of the table.
+    :return: The table as a DataFrame.
+    """
+    return pd.read_csv(open_body(stream, content_encoding), sep=sep)
+
+
+def iter_csv(df: pd.DataFrame, chunk_rows: int = 10000):
+    """Yield the table as CSV, chunk_rows rows at a time, the first chunk with the header."""
+    yield df.iloc[:chunk_rows].to_csv(index=False)
+    for start in range(chunk_rows, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False)
+
+
+def iter_arrow(df: pd.DataFrame, chunk_rows: int = 10000):
+    """Yield the table in the Arrow IPC streaming format, one record batch of chunk_rows rows at a time."""
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    sink = io.BytesIO()
+
+    def flush():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=chunk_rows):
+            writer.write_batch(batch)
+            yield flush()
+    yield flush()
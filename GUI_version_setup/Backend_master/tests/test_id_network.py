@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import spectral_entropy
+from app import process_id_logic
+from id_network import MAX_DEFAULT_WORKERS, MS2_DA, SIMILARITY_METHOD, default_workers, iter_network_edges
+
+
+def _random_peak_table(n_rows, seed=0):
+    """Peaks sharing fragments, so that most pairs have a similarity above 0."""
+    rng = np.random.default_rng(seed)
+    fragments = np.round(rng.uniform(50, 300, 12), 4)
+    rows = []
+    for k in range(n_rows):
+        mz = np.sort(rng.choice(fragments, 5, replace=False) + rng.normal(0, 0.002, 5))
+        intensity = rng.uniform(1, 100, 5)
+        spectrum = " ".join("{:.4f}:{:.1f}".format(m, i) for m, i in zip(mz, intensity))
+        rows.append({"PeakID": k, "RT (min)": float(k), "Precursor m/z": 300 + 14.01565 * k,
+                     "MSMS spectrum": spectrum})
+    return pd.DataFrame(rows)
+
+
+def _node_spectra(peak_table):
+    return [spectral_entropy.clean_spectrum(
+        [[float(v) for v in peak.split(":")] for peak in spectrum.split()],
+        max_mz=800, noise_removal=0.01, ms2_da=0.01) for spectrum in peak_table["MSMS spectrum"]]
+
+
+def test_edges_are_scored_with_ms_for_id_v1():
+    peak_table = _random_peak_table(8)
+    spectra = _node_spectra(peak_table)
+    edges = list(iter_network_edges(peak_table["Precursor m/z"], spectra, spectra, -1, n_workers=1))
+    assert len(edges) == 8 * 7 // 2
+    for i, j, _, ms2_sim, _ in edges:
+        expected = spectral_entropy.similarity(spectra[i], spectra[j], method=SIMILARITY_METHOD, ms2_da=MS2_DA)
+        assert ms2_sim == pytest.approx(expected)
+
+
+def test_id_result_reports_ms_for_id_v1_similarity():
+    peak_table = _random_peak_table(8)
+    pmd_table = pd.DataFrame({"Mass Difference (Da)": [14.01565], "Reaction": ["CH2"], "Description": ["methylation"]})
+    result = process_id_logic(peak_table, None, pmd_table, 0.0, 0.01, n_workers=1)
+    assert len(result) > 0
+
+    spectra = _node_spectra(peak_table)
+    n_different = 0
+    for a, b, score in zip(result["PeakID_a"], result["PeakID_b"], result["MSforID distance version 1"]):
+        expected = spectral_entropy.similarity(spectra[a], spectra[b], method="ms_for_id_v1", ms2_da=MS2_DA)
+        assert score == pytest.approx(expected)
+        dot_product = spectral_entropy.similarity(spectra[a], spectra[b], method="dot_product", ms2_da=MS2_DA)
+        n_different += not np.isclose(score, dot_product)
+    # The spectra tell the two methods apart, so that the column cannot silently hold another score.
+    assert n_different > 0
+
+
+def test_pool_yields_edges_sorted_by_pair():
+    peak_table = _random_peak_table(12, seed=1)
+    spectra = _node_spectra(peak_table)
+    serial = list(iter_network_edges(peak_table["Precursor m/z"], spectra, spectra, 0.0, n_workers=1, block_size=5))
+    parallel = list(iter_network_edges(peak_table["Precursor m/z"], spectra, spectra, 0.0, n_workers=3, block_size=5))
+    assert len(serial) > 0 and serial == sorted(serial)
+    assert parallel == serial
+
+
+def test_default_workers(monkeypatch):
+    monkeypatch.setenv("ID_WORKERS", "3")
+    assert default_workers() == 3
+    monkeypatch.delenv("ID_WORKERS")
+    assert 1 <= default_workers() <= MAX_DEFAULT_WORKERS
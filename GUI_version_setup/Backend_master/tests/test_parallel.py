@@ -0,0 +1,24 @@
+import numpy as np
+
+import spectral_entropy
+from spectral_entropy.parallel import split_blocks
+
+
+def test_split_blocks_covers_every_row_once():
+    for n_rows in (0, 1, 7, 50):
+        for block_size in (1, 5, 20000):
+            blocks = split_blocks((n_rows - i for i in range(n_rows)), block_size)
+            rows = [i for i_start, i_end in blocks for i in range(i_start, i_end)]
+            assert rows == list(range(n_rows))
+            # Every block but the last holds at least block_size pairs, and stops at the row reaching it.
+            for i_start, i_end in blocks[:-1]:
+                assert sum(n_rows - i for i in range(i_start, i_end)) >= block_size
+                assert sum(n_rows - i for i in range(i_start, i_end - 1)) < block_size
+
+
+def test_similarity_matrix_is_the_same_in_a_pool():
+    rng = np.random.default_rng(0)
+    spectra = [np.column_stack((np.sort(rng.uniform(50, 60, 6)), rng.uniform(1, 100, 6))) for _ in range(12)]
+    serial = spectral_entropy.similarity_matrix(spectra, ms2_da=0.05, n_workers=1, chunk_size=10)
+    parallel = spectral_entropy.similarity_matrix(spectra, ms2_da=0.05, n_workers=3, chunk_size=10)
+    np.testing.assert_array_equal(parallel, serial)
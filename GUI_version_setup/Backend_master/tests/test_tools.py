@@ -0,0 +1,182 @@
+import numpy as np
+import pytest
+
+from spectral_entropy import clean_spectra_batch, clean_spectrum, tools
+
+
+def _random_spectra(rng, n_spectra):
+    """Spectra of 0 to 300 peaks, some with peaks closer than the tolerance and some with tied intensities."""
+    spectra = []
+    for _ in range(n_spectra):
+        n_peaks = rng.choice([0, 1, 2, 5, 20, 300])
+        mz = rng.uniform(50, 500, n_peaks)
+        if n_peaks > 2 and rng.random() < 0.5:
+            mz[1] = mz[0] + 0.01
+        intensity = rng.uniform(0, 1000, n_peaks)
+        if n_peaks > 2 and rng.random() < 0.5:
+            intensity[:2] = intensity.max()
+        spectra.append(np.column_stack((mz, intensity)).astype(np.float32))
+    return spectra
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(),
+    dict(max_mz=300),
+    dict(noise_removal=None, ms2_da=0.01),
+    dict(ms2_da=None, ms2_ppm=20),
+])
+def test_clean_spectra_batch_is_bit_exact(kwargs):
+    rng = np.random.default_rng(0)
+    spectra = _random_spectra(rng, 200)
+    offsets = np.concatenate(([0], np.cumsum([spectrum.shape[0] for spectrum in spectra])))
+    mz = np.concatenate([spectrum[:, 0] for spectrum in spectra])
+    intensity = np.concatenate([spectrum[:, 1] for spectrum in spectra])
+
+    batch_mz, batch_intensity, batch_offsets = clean_spectra_batch(mz, intensity, offsets, **kwargs)
+    for i, spectrum in enumerate(spectra):
+        expected = clean_spectrum(spectrum, **kwargs)
+        start, end = batch_offsets[i], batch_offsets[i + 1]
+        np.testing.assert_array_equal(batch_mz[start:end], expected[:, 0])
+        np.testing.assert_array_equal(batch_intensity[start:end], expected[:, 1])
+
+
+def test_clean_spectra_batch_keeps_empty_spectra():
+    mz = np.array([100, 200, 150], dtype=np.float32)
+    intensity = np.array([1, 3, 2], dtype=np.float32)
+    batch_mz, batch_intensity, batch_offsets = clean_spectra_batch(mz, intensity, [0, 0, 2, 2, 3, 3])
+    np.testing.assert_array_equal(batch_offsets, [0, 0, 2, 2, 3, 3])
+    np.testing.assert_array_equal(batch_mz, [100, 200, 150])
+    np.testing.assert_array_equal(batch_intensity, np.array([0.25, 0.75, 1], dtype=np.float32))
+
+
+def _sorted_spectrum(mz, intensity):
+    spectrum = np.column_stack((mz, intensity)).astype(np.float32)
+    return spectrum[np.argsort(spectrum[:, 0], kind="stable")]
+
+
+def _centroid_cases():
+    rng = np.random.default_rng(1)
+    cases = []
+    for n_peaks in (1, 2, 10, 100, 500):
+        # Random peaks, many of them closer than the tolerance.
+        cases.append(_sorted_spectrum(rng.uniform(100, 110, n_peaks), rng.uniform(0, 100, n_peaks)))
+        # Tied intensities: the order of the peaks of the same intensity decides which one merges the others.
+        cases.append(_sorted_spectrum(rng.uniform(100, 102, n_peaks), rng.choice([10.0, 20.0], n_peaks)))
+        # Peaks of intensity 0, alone and next to other peaks.
+        intensity = rng.uniform(0, 100, n_peaks)
+        intensity[rng.random(n_peaks) < 0.3] = 0
+        cases.append(_sorted_spectrum(rng.uniform(100, 105, n_peaks), intensity))
+    cases.append(_sorted_spectrum([100, 100.01, 200], [0, 0, 0]))
+    return cases
+
+
+@pytest.mark.parametrize("tolerance", [dict(ms2_da=0.05), dict(ms2_da=0.5), dict(ms2_ppm=20), dict(ms2_ppm=500)])
+def test_centroid_spec_numpy_is_the_same_as_tools_fast(tolerance):
+    if tools.tools_fast is None:
+        pytest.skip("tools_fast is not built")
+    for spectrum in _centroid_cases():
+        # tools_fast sets the intensity of the merged peaks to 0 in the spectrum it is given.
+        expected = tools.tools_fast.centroid_spec(spectrum.copy(), tolerance.get("ms2_ppm"), tolerance.get("ms2_da"))
+        centroided = tools._centroid_spec_numpy(spectrum, **tolerance)
+        np.testing.assert_array_equal(centroided, expected.reshape(-1, 2))
+
+
+@pytest.mark.parametrize("centroid", [tools.centroid_spec, tools._centroid_spec_numpy])
+def test_centroid_spec_of_empty_spectrum(centroid):
+    # tools_fast returns a 1-D array for an empty spectrum, centroid_spec always returns one of shape (0, 2).
+    for spectrum in ([], np.zeros((0, 2), dtype=np.float32)):
+        centroided = centroid(spectrum, ms2_da=0.05)
+        assert centroided.shape == (0, 2)
+        assert centroided.dtype == np.float32
+
+
+def _match_peaks_loop(spec_a, spec_b, ms2_ppm, ms2_da, with_mz_info):
+    """
+    The per-pair loop versions of match_peaks_in_spectra and match_peaks_with_mz_info_in_spectra. Without the m/z info,
+    the intensities are summed in float32, as tools_fast.match_spectrum does.
+    """
+    a, b = 0, 0
+    spec_merged = []
+    zero = 0. if with_mz_info else np.float32(0.)
+    peak_b_mz, peak_b_int = 0., zero
+    while a < spec_a.shape[0] and b < spec_b.shape[0]:
+        if with_mz_info:
+            mass_delta = (spec_a[a, 0] - spec_b[b, 0]) / spec_a[a, 0] * 1e6
+            tolerance = ms2_ppm if ms2_da is None else ms2_da / spec_a[a, 0] * 1e6
+        else:
+            mass_delta = spec_a[a, 0] - spec_b[b, 0]
+            tolerance = ms2_da if ms2_da is not None else ms2_ppm * 1e-6 * spec_a[a, 0]
+        if mass_delta < -tolerance:
+            # Peak only existed in spec a.
+            spec_merged.append([spec_a[a, 0], spec_a[a, 1], peak_b_mz, peak_b_int] if with_mz_info else
+                               [spec_a[a, 0], spec_a[a, 1], peak_b_int])
+            peak_b_mz, peak_b_int = 0., zero
+            a += 1
+        elif mass_delta > tolerance:
+            # Peak only existed in spec b.
+            spec_merged.append([0., 0., spec_b[b, 0], spec_b[b, 1]] if with_mz_info else
+                               [spec_b[b, 0], 0., spec_b[b, 1]])
+            b += 1
+        else:
+            # Peak existed in both spec.
+            if with_mz_info:
+                peak_b_mz = ((peak_b_mz * peak_b_int) + (spec_b[b, 0] * spec_b[b, 1])) / (peak_b_int + spec_b[b, 1])
+            peak_b_int += spec_b[b, 1]
+            b += 1
+    if peak_b_int > 0.:
+        spec_merged.append([spec_a[a, 0], spec_a[a, 1], peak_b_mz, peak_b_int] if with_mz_info else
+                           [spec_a[a, 0], spec_a[a, 1], peak_b_int])
+        a += 1
+    spec_merged += [[0., 0., x[0], x[1]] if with_mz_info else [x[0], 0., x[1]] for x in spec_b[b:]]
+    spec_merged += [[x[0], x[1], 0., 0.] if with_mz_info else [x[0], x[1], 0.] for x in spec_a[a:]]
+    if not spec_merged:
+        spec_merged = [[0.] * (4 if with_mz_info else 3)]
+    return np.array(spec_merged, dtype=np.float64)
+
+
+def _match_cases():
+    rng = np.random.default_rng(2)
+    grid = np.round(np.arange(100, 103, 0.01), 2)
+
+    def spectrum(n_peaks):
+        # Peaks on a grid finer than the tolerance, so that several peaks b often match the same peak a.
+        return _sorted_spectrum(rng.choice(grid, n_peaks), rng.uniform(0, 1, n_peaks))
+
+    cases = [(spectrum(rng.integers(1, 40)), spectrum(rng.integers(1, 40))) for _ in range(200)]
+    cases += [(spectrum(0), spectrum(0)), (spectrum(5), spectrum(0)), (spectrum(0), spectrum(5))]
+    return cases
+
+
+@pytest.mark.parametrize("tolerance", [dict(ms2_da=0.01), dict(ms2_da=0.05), dict(ms2_ppm=20), dict(ms2_ppm=200)])
+@pytest.mark.parametrize("with_mz_info", [False, True])
+def test_match_peaks_is_the_same_as_the_loop(tolerance, with_mz_info):
+    ms2_ppm, ms2_da = tolerance.get("ms2_ppm"), tolerance.get("ms2_da")
+    cases = _match_cases()
+    expected = [_match_peaks_loop(spec_a, spec_b, ms2_ppm, ms2_da, with_mz_info) for spec_a, spec_b in cases]
+
+    one_by_one = [tools._match_peaks(*tools._spectrum_arrays(spec_a), *tools._spectrum_arrays(spec_b),
+                                     ms2_ppm, ms2_da, with_mz_info)[0] for spec_a, spec_b in cases]
+    # All pairs at once, the empty spectra are empty segments among the others.
+    batch = tools._match_peaks(*tools._spectrum_arrays(*[spec_a for spec_a, _ in cases]),
+                               *tools._spectrum_arrays(*[spec_b for _, spec_b in cases]),
+                               ms2_ppm, ms2_da, with_mz_info)
+    assert len(batch) == len(cases)
+    for matched, matched_batch, loop in zip(one_by_one, batch, expected):
+        np.testing.assert_array_equal(matched, loop)
+        np.testing.assert_array_equal(matched_batch, loop)
+
+
+@pytest.mark.parametrize("ms2_da", [0.01, 0.05])
+def test_match_peaks_is_the_same_as_tools_fast(ms2_da):
+    if tools.tools_fast is None:
+        pytest.skip("tools_fast is not built")
+    for spec_a, spec_b in _match_cases():
+        expected = tools.tools_fast.match_spectrum(spec_a.copy(), spec_b.copy(), ms2_da=ms2_da)
+        matched = tools._match_peaks(*tools._spectrum_arrays(spec_a), *tools._spectrum_arrays(spec_b),
+                                     None, ms2_da, with_mz_info=False)[0]
+        if spec_a.shape[0] == 0 and spec_b.shape[0] == 0:
+            # Two empty spectra: tools_fast gives no row, the numpy version one row of 0 as the loop version.
+            assert expected.shape == (0, 3)
+            np.testing.assert_array_equal(matched, [[0, 0, 0]])
+            continue
+        np.testing.assert_array_equal(matched, expected)
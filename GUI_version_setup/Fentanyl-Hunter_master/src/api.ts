@@ -0,0 +1,46 @@
+import axios from 'axios';
+
+const API_BASE = 'http://127.0.0.1:5000';
+
+export interface JobStatus {
+  job_id: string;
+  kind: string;
+  state: 'queued' | 'running' | 'succeeded' | 'failed' | 'cancelled';
+  stage: string | null;
+  done: number | null;
+  total: number | null;
+  error?: string;
+  result?: any;
+}
+
+// 以后台任务方式提交请求：后端立即返回任务 ID，之后轮询任务状态直到结束，避免长时间运行的请求超时
+// 返回值与 axios.post 的响应格式一致（status、statusText、data）
+export const runJob = async (
+  path: string,
+  payload: Record<string, any>,
+  onProgress?: (job: JobStatus) => void,
+  pollInterval = 1000
+) => {
+  const submitted = await axios.post(`${API_BASE}${path}`, { ...payload, async: true });
+  const jobId = submitted.data?.job_id;
+  if (!jobId) {
+    // 后端不支持任务队列时直接返回了处理结果
+    return submitted;
+  }
+
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, pollInterval));
+    const { data: job } = await axios.get<JobStatus>(`${API_BASE}/api/v1/jobs/${jobId}`);
+    onProgress?.(job);
+
+    if (job.state === 'succeeded') {
+      return { status: 200, statusText: 'OK', data: job.result };
+    }
+    if (job.state === 'failed') {
+      throw new Error(job.error || 'Job failed');
+    }
+    if (job.state === 'cancelled') {
+      throw new Error('Job cancelled');
+    }
+  }
+};